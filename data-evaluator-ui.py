@@ -1,10 +1,38 @@
 import json
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 import os
-import math
-import matplotlib.pyplot as plt
+import threading
+
+from evaluator.benchmark import breakdown, load_benchmark_index
+from evaluator.charts import outcome_pies
+from evaluator.columnar import OUTCOMES
+from evaluator.compare import compare
+from evaluator.dataset import DATA_DIR, MEMORY_BUDGET, DatasetCache, list_eval_files
+from evaluator.instrumentation import METRICS, serve_prometheus
+from evaluator.search import FLAG_FACETS
+from evaluator.sparql import analyze, pretty_print
+from evaluator.warmup import warm_up
+from evaluator.preprocess import (ICON_CORRECT, ICON_ERROR, ICON_INCORRECT, ICON_MASK, ICON_NOT_VALID,
+                                  ICON_SPARQL_QUERY_INCORRECT, ICON_UNKNOWN, check_sparql_query,
+                                  get_prepared_results)
 
 PROCESSES = ["direct", "NER", "masked"]
+# facets of the record filter and their labels
+FILTERS = {"model": "Model", "process": "Process", "outcome": "Outcome", "expected_type": "Expected query type",
+           "predicted_type": "Predicted query type", "error_extra": "Error tags"}
+
+# opt-in diagnostics: EVALUATOR_DIAGNOSTICS=1 turns them on for the server, EVALUATOR_METRICS_PORT serves them
+# on localhost for Prometheus (/metrics), EVALUATOR_METRICS_LOG appends them to a JSON lines file after every rerun
+DIAGNOSTICS = os.environ.get("EVALUATOR_DIAGNOSTICS", "") not in ("", "0")
+METRICS_PORT = os.environ.get("EVALUATOR_METRICS_PORT")
+METRICS_LOG = os.environ.get("EVALUATOR_METRICS_LOG")
+# memory budget of the loaded files, files no session is viewing are unloaded beyond it
+MEMORY_BUDGET_MB = int(os.environ.get("EVALUATOR_MEMORY_BUDGET_MB", MEMORY_BUDGET // (1024 * 1024)))
+
+# the lru caches count their hits since the start of the server
+METRICS.register_cache("outcome_pies", lambda: tuple(outcome_pies.cache_info()[:2]))
+METRICS.register_cache("sparql_analyze", lambda: tuple(analyze.cache_info()[:2]))
 
 
 def read_data(file):
@@ -13,44 +41,6 @@ def read_data(file):
     return data
 
 
-ICON_NOT_VALID = "🚫"
-ICON_ERROR = "❌"
-ICON_CORRECT = "✅"
-ICON_INCORRECT = "⚠️"
-ICON_UNKNOWN = "❓"
-ICON_SPARQL_QUERY_INCORRECT = "🛑"
-ICON_MASK = '👺'
-
-
-def get_prepared_results(data):
-    global ICON_NOT_VALID
-    global ICON_ERROR
-    global ICON_CORRECT
-    global ICON_INCORRECT
-    global ICON_UNKNOWN
-    # global ICON_MASK
-
-    valid_query = data.get("valid_query")
-    error = data.get("error")
-    correct = data.get("correct")
-    # mask_broken = data.get('wikidata_uri_in_masked')
-
-    if valid_query != True:
-        icon = ICON_NOT_VALID
-        message = "Invalid response(the query was NOT successfully extracted from LLM response or has NOT passed RDFlib syntax check 'error' contains reason to fail). Error: {error}"
-    elif error != None:
-        icon = ICON_ERROR
-        message = "Error response: should not be here if valid_query is None"
-    elif correct == True:
-        icon = ICON_CORRECT
-        message = "Correct response: query returns non-empty list, and set of returned URIs is equal to set of URIs from the gold standard"
-    else:
-        icon = ICON_INCORRECT
-        message = "Incorrect response: query returns empty list, or set of returned URIs is not equal to set of URIs from the gold standard"
-
-    return icon, message
-
-
 def get_item(data):
     question = data.get("question")
     model = data.get("model")
@@ -66,132 +56,208 @@ def get_item(data):
     return question, model, process, prompt, response, normal_query, valid_query, error, correct, icon, message
 
 
-def check_sparql_query(normal_query):
-    if normal_query != None and ("SELECT" in normal_query or "ASK" in normal_query):
-        return True
-    return False
+def result_icon(columns, row):
+    """Outcome icon of a row, with the missing SELECT/ASK marker for invalid queries"""
+    icon = OUTCOMES[columns["outcome"][row]]
+    if icon == ICON_NOT_VALID and (columns["sparql_query_incorrect"][row] or not columns["has_normal_query"][row]):
+        icon += ICON_SPARQL_QUERY_INCORRECT
+    return icon
+
+
+def summary_table(columns, index, page, models, matches=None):
+    """One row per shown question and model with the icons of every process, read from the columns only
+
+    With matches (a set of row ids of a filter), only the matching rows are shown.
+    """
+    rows = []
+    for i, question in page:
+        for model in models:
+            row = {"ID": i, "Question": question, "Model": model}
+            for process in PROCESSES:
+                row[process] = " ".join(result_icon(columns, line)
+                                        for line in index.rows(i, process, model)
+                                        if matches is None or line in matches)
+            if matches is None or any(row[process] for process in PROCESSES):
+                rows.append(row)
+    return rows
+
+
+def record_filter(search):
+    """Sidebar filters and question search, returns the matching row ids or None if nothing is filtered"""
+    with st.sidebar.expander("Filter records"):
+        filters = {facet: st.multiselect(label, [value for value, _ in search.values(facet)], format_func=str,
+                                         key=f"filter-{facet}")
+                   for facet, label in FILTERS.items()}
+        for flag in st.multiselect("Flags", FLAG_FACETS, key="filter-flags"):
+            filters[flag] = [True]
+        text = st.text_input("Question contains", key="filter-text")
+        with METRICS.span("ui.search"):
+            matches = search.select(filters, text)
+        if matches is not None:
+            st.write(f"{len(matches)} of {search.row_count} rows")
+        METRICS.count("widgets", len(filters) + 3)
+    return matches
+
+
+def show_record(line):
+    question, model, process, prompt, response, normal_query, valid_query, error, correct, icon, message = get_item(
+        line)
+
+    METRICS.count("records_shown")
+    METRICS.count("widgets", 6)
+    st.code(prompt, language="text", wrap_lines=True)
+
+    with st.expander(f"{icon} Response Details: {message} <br>// error: {error} // valid_query: {valid_query} // correct: {correct}"):
+        st.write(
+            f"Eval: Error: {error}, valid_query: {valid_query}, correct: {correct}")
+        st.code(response, language="json")
+
+    st.write("Generated Query (`normal_query`):")
+    # the check and the layout share one cached analysis of the query
+    if not check_sparql_query(normal_query):
+        st.write(ICON_SPARQL_QUERY_INCORRECT)
+
+    # quick format of the SPARQL query while adding line breaks
+    st.code(pretty_print(normal_query))
+    # collapse accordion to show details
+    with st.expander("Details"):
+        st.code(json.dumps(line, indent=2),
+                language="json")
+
+
+def show_question_details(i, question, columns, index, models, matches=None):
+    """All records of one question, decoded from the source file only when they are shown
+
+    With matches (a set of row ids of a filter), only the matching records and their models are shown.
+    """
+    tabulated_data = index.question_records(i, columns, models, matches)
+    if matches is not None:
+        models = [model for model in models if any(tabulated_data[process][model] for process in tabulated_data)]
+    number_of_columns = len(PROCESSES) + 1
+
+    process_columns = st.columns(number_of_columns, border=True)
+    # show the process names
+    for j, process in enumerate(PROCESSES):
+        with process_columns[j+1]:
+            st.write(process)
 
+    # show results for each model
+    for model in models:
+        process_columns = st.columns(number_of_columns, border=True)
+        with process_columns[0]:
+            st.write(model)
 
-def preprocess(record):
-    """Adds additional fields to the record based on the input and the model response"""
-    if not isinstance(record, dict):
-        return
-    
-    if 'error_extra' not in record:
-        record['error_extra'] = []
-
-    record['multiple_clause'] = False
-    record['wikidata_uri_in_masked'] = False
-
-    try:
-        response = record.get("response")
-        response = json.loads(response)
-        query = ' '.join(response.get("query", [])).lower().split()
-
-        if query.count("select") > 1:
-            record['error_extra'].append('Multiple SELECT keywords')
-            record['multiple_clause'] = True
-        if query.count("ask") > 1:
-            record['error_extra'].append('Multiple ASK keywords')
-            record['multiple_clause'] = True
-        
-        if record.get('process', None) == 'masked':
-            if any(i.startswith('wd:') or i.startswith('wdt:') for i in query):
-                record['error_extra'].append('Wikidata URIs present in the masked process output')
-                record['wikidata_uri_in_masked'] = True
-
-        if True in record.get('gold', []) or False in record.get('gold', []):
-            record['expected_type'] = 'ASK'
-        elif record.get('gold') is None:
-            record['expected_type'] = None
-        else:
-            record['expected_type'] = 'SELECT'
+        for j, process in enumerate(PROCESSES):
+            with process_columns[j+1]:
+                if process not in tabulated_data:
+                    if matches is not None:
+                        # no matching records of this process
+                        continue
+                    st.write(
+                        f"No process data found: {question} {process}")
+                    # show the details with error icon
+                    with st.expander("Details", icon=ICON_ERROR):
+                        st.code(json.dumps(
+                            tabulated_data, indent=2))
+                    continue
 
-        if 'ask' in query:
-            record['predicted_type'] = 'ASK'
-        elif 'select' in query:
-            record['predicted_type'] = 'SELECT'
-        else:
-            record['predicted_type'] = None
-
-    except Exception as e:
-        record['error_extra'].append(f'Exception in function preprocess: {e}')
-
-
-def prepare_stats(data):
-    """Prepares statistics for the data"""
-    stats = {
-        "total": 0,
-        "correct": 0,
-        "incorrect": 0,
-        "error": 0,
-        "valid": 0,
-        "invalid": 0,
-        "unknown": 0,
-        "sparql_query_incorrect": 0,
-        "multiple_clause": 0,
-        "wikidata_uri_in_masked": 0,
-        "wrong_type_predicted": 0,
-    }
-
-    for x, record in enumerate(data):
-        stats["total"] += 1
-        stats["correct"] += 1 if record.get('correct', 0) else 0
-        stats["valid"] += 1 if record.get('valid_query', 0) else 0
-        stats["invalid"] += 1 - int(record.get('valid_query', 0))
-
-        # if record.get('multiple_clause', False):
-        #     stats["multiple_clause"] += 1
-        # if record.get('wikidata_uri_in_masked', False):
-        #     stats["wikidata_uri_in_masked"] += 1
-        # if record.get('expected_type', None) is None:
-        #     stats["expected_type"] += 1
-        # if record.get('predicted_type', None) is None:
-        #     stats["predicted_type"] += 1
-
-    stats["incorrect"] = stats["valid"] - stats["correct"]
-
-    print(stats)
-
-    return stats
-
-
-class LazyData:
-    def __init__(self, file_name):
-        self.file_name = file_name
-        self._data = None
-        self.statistics = None
-
-    def _load_data(self):
-        try:
-            with open(self.file_name, "r") as f:
-                self._data = [json.loads(line) for line in f]
-        except FileNotFoundError:
-            st.error(f"File not found: {self.file_name}")
-            self._data = []
-        except json.JSONDecodeError as e:
-            st.error(f"Error decoding JSON: {e}")
-            self._data = []
-        except Exception as e:
-            st.error(f"An unexpected error occurred: {e}")
-            self._data = []
-
-    @property
-    def data(self):
-        if self._data is None:
-            self._load_data()
-            for x, i in enumerate(self._data):
-                preprocess(i)
-                i["id"] = x
-            # self.statistics = prepare_stats(self._data)
-        return self._data
-
-
-lazy_data = {}
-
-file_list = os.listdir("data")
-for file in file_list:
-    lazy_data[file] = LazyData(f"data/{file}")
+                for line in tabulated_data[process][model]:
+                    show_record(line)
+
+
+def counterpart(file, file_list):
+    """The same models on the other question set: mcwq-* <-> optimized-*"""
+    for a, b in (("mcwq-", "optimized-"), ("optimized-", "mcwq-")):
+        if file.startswith(a) and file.replace(a, b, 1) in file_list:
+            return [file.replace(a, b, 1)]
+    return []
+
+
+def show_comparison(file, others):
+    """Per cell deltas and outcome flips of the selected file against each of the other files"""
+    base = lazy_data[file].columns
+    for other, comparison in zip(others, compare([base] + [lazy_data[other].columns for other in others])):
+        METRICS.count("widgets", 4)
+        st.subheader(f"{file} → {other}")
+        st.write(f"{len(comparison)} aligned rows by question, model and process "
+                 f"({comparison.base_only} only in {file}, {comparison.other_only} only in {other})")
+        st.dataframe(comparison.delta_table(), hide_index=True, use_container_width=True)
+
+        model = st.selectbox("Flips of model", ["all"] + comparison.models, key=f"flips-{file}-{other}")
+        flips = comparison.flip_matrix(None if model == "all" else model)
+        st.dataframe([{"from ↓ to →": icon, **{to: int(n) for to, n in zip(OUTCOMES, row)}}
+                      for icon, row in zip(OUTCOMES, flips)], hide_index=True)
+
+
+@st.cache_resource(show_spinner=False)
+def get_lazy_data():
+    """EvalFiles by name, shared by all sessions (the script itself is re-executed on every rerun)"""
+    return DatasetCache(DATA_DIR, MEMORY_BUDGET_MB * 1024 * 1024)
+
+
+@st.cache_resource(show_spinner=False)
+def get_benchmark_index():
+    """Join index of the benchmark, shared by all sessions"""
+    return load_benchmark_index()
+
+
+@st.cache_resource(show_spinner=False)
+def start_warm_up(file_list):
+    """Prepares the caches of all files in the background (once per server), so switching files never stalls"""
+    thread = threading.Thread(target=warm_up, args=(
+        [os.path.join(DATA_DIR, file) for file in file_list],), daemon=True)
+    thread.start()
+    return thread
+
+
+@st.cache_resource(show_spinner=False)
+def configure_metrics():
+    """Turns the diagnostics on if the environment asks for them and starts the Prometheus endpoint, once per server"""
+    METRICS.enabled = DIAGNOSTICS or bool(METRICS_PORT) or bool(METRICS_LOG)
+    return serve_prometheus(int(METRICS_PORT)) if METRICS_PORT else None
+
+
+def toggle_diagnostics():
+    # METRICS is shared by all sessions, so this turns the diagnostics on or off for the whole server
+    METRICS.enabled = st.session_state.diagnostics or DIAGNOSTICS or bool(METRICS_PORT) or bool(METRICS_LOG)
+
+
+def show_diagnostics():
+    """Sidebar panel with the span timings, counters and cache hit rates of the server"""
+    st.session_state.setdefault("diagnostics", METRICS.enabled)
+    st.sidebar.toggle("Diagnostics", key="diagnostics", on_change=toggle_diagnostics)
+    if not METRICS.enabled:
+        return
+    snapshot = METRICS.snapshot()
+    if METRICS_LOG:
+        METRICS.write_log(METRICS_LOG)
+    with st.sidebar.expander("Diagnostics", expanded=True):
+        st.dataframe([{"Span": name, "Count": span["count"], "Last ms": span["last"] * 1000,
+                       "Mean ms": span["total"] / span["count"] * 1000, "Max ms": span["max"] * 1000}
+                      for name, span in sorted(snapshot["spans"].items())],
+                     hide_index=True, use_container_width=True)
+        st.dataframe([{"Counter": name, "Value": value} for name, value in sorted(snapshot["counters"].items())],
+                     hide_index=True, use_container_width=True)
+        st.dataframe([{"Cache": name, "Hits": cache["hits"], "Misses": cache["misses"],
+                       "Hit rate": cache["hit_rate"]}
+                      for name, cache in sorted(snapshot["caches"].items())],
+                     hide_index=True, use_container_width=True)
+        memory = lazy_data.memory()
+        st.write(f"{len(memory)} files loaded, {sum(memory.values()) / 2**20:.1f} of {MEMORY_BUDGET_MB} MiB")
+        st.dataframe([{"File": name, "MiB": size / 2**20, "Sessions": lazy_data.refcount(name)}
+                      for name, size in memory.items()], hide_index=True, use_container_width=True)
+        if st.button("Reset"):
+            METRICS.reset()
+            st.rerun()
+
+
+@st.fragment(run_every=5)
+def follow_file(file):
+    """Checks the file for appended lines every few seconds and reruns the app when there are some"""
+    with METRICS.span("ui.follow"):
+        new_rows = lazy_data[file].refresh()
+    if new_rows:
+        st.rerun()
 
 
 def main():
@@ -213,6 +279,12 @@ def main():
 
     st.title("Data Evaluator UI")
 
+    # evaluation files in folder data, loaded lazily and shared by all sessions
+    with METRICS.span("ui.files"):
+        file_list = list_eval_files()
+        lazy_data = get_lazy_data()
+        start_warm_up(tuple(file_list))
+
     st.sidebar.header("Choose data source")
 
     # read all files from folder data
@@ -222,9 +294,31 @@ def main():
     st.sidebar.subheader("Select from existing files")
     file = st.sidebar.selectbox("Select file", file_list)
 
+    # aligned comparison with other files, e.g. the optimized questions of the same models
+    compare_with = st.sidebar.multiselect("Compare with", [other for other in file_list if other != file],
+                                          default=counterpart(file, file_list))
+    # counted once per shown file and rerun: was it still loaded, or is it loaded again
+    for name in [file] + compare_with:
+        METRICS.hit("datasets", lazy_data[name].loaded())
+    for other in compare_with:
+        lazy_data[other].refresh()
+    compare_with = [other for other in compare_with if lazy_data[other].columns is not None]
+    # the files of this session are not unloaded while it views them
+    lazy_data.hold(get_script_run_ctx().session_id, [file] + compare_with)
+
+    # evaluation jobs append to their file while they run
+    follow = st.sidebar.toggle("Follow file while it grows", value=False)
+    lazy_data[file].refresh()
+    if follow:
+        follow_file(file)
+
     # read JSONL data from selected file
     # data = read_data(file)
-    data = lazy_data[file].data
+    with METRICS.span("ui.load"):
+        columns = lazy_data[file].columns
+    if columns is None:
+        st.error(lazy_data[file].error)
+        return
 
     # preprocess data:
     # - Wikidata URIs present in the masked process output
@@ -234,283 +328,134 @@ def main():
     # for i in data:
     #     preprocess(i)
 
-    # collect all model names from the data
-    # tabulated_data_rows_ids = {}
-    # for line in data:
-        # line = json.loads(line)
-        # model = line.get("model")
-        # if model not in tabulated_data_rows_ids:
-        # tabulated_data_rows_ids[model] = []
-        # tabulated_data_rows_ids[model].append(line)
-    # remove duplicates
-    # tabulated_data_rows_ids = set(tabulated_data_rows_ids.keys())
-    # tabulated_data_rows_ids.sort()    
-    tabulated_data_rows_ids = {line.get("model") for line in data}
-
-    # collect all process names from the data
-    # tabulated_data_column_ids = {}
-    # for line in data:
-        # line = json.loads(line)
-        # process = line.get("process")
-        # if process not in tabulated_data_column_ids:
-        # tabulated_data_column_ids[process] = []
-        # tabulated_data_column_ids[process].append(line)
-    # remove duplicates
-    # tabulated_data_column_ids = set(tabulated_data_column_ids.keys())
-    tabulated_data_column_ids = {line.get("process") for line in data}
+    # statistics are computed once per file on the columnar data
+    with METRICS.span("ui.statistics"):
+        statistics = lazy_data[file].statistics
+
+    # all model names from the data
+    tabulated_data_rows_ids = statistics.models
+
+    # all process names from the data
+    tabulated_data_column_ids = set(statistics.processes)
 
     # warn if process names are not the same
     if tabulated_data_column_ids != set(PROCESSES):
         st.warning(
             f"Process names in the data are different from the expected ones: {tabulated_data_column_ids} (expected: {PROCESSES})")
 
-    # create a dictionary to store statistics
-    statistics = {}
-    statistics_extra = {}
-
-    for model in tabulated_data_rows_ids:
-        statistics[model] = {}
-        statistics_extra[model] = {}
-        for process in PROCESSES:
-            statistics[model][process] = {}
-            statistics_extra[model][process] = {}
-
-    number_of_experiments_per_question = len(PROCESSES) * len(
-        tabulated_data_rows_ids)
-
-    # slider to select number of experiments
-    # divide lines by number of experiments per question
-    max_questions = math.ceil(len(data) / number_of_experiments_per_question)
-
-    number_of_questions = st.sidebar.slider(
-        "Show this number of questions", 1, max_questions, 50)
-
-    first_question = st.sidebar.slider(
-        "ID of first question to be shown", 0, max_questions - 1, 50)
-
-    # sort data
-    data.sort(key=lambda x: x.get("id"))
-
-    # organize all data
-    tabulated_data = {}
-    for line in data:
-        # line = json.loads(line)
-        # preprocess(line)
-        question = line.get("question")
-        model = line.get("model")
-        process = line.get("process")
-
-        # check and initialize the dictionary
-        if question not in tabulated_data:
-            tabulated_data[question] = {}
-        for process_original in PROCESSES:
-            if process_original not in tabulated_data[question]:
-                tabulated_data[question][process] = {}
-        for model_original in tabulated_data_rows_ids:
-            if model_original not in tabulated_data[question][process]:
-                tabulated_data[question][process][model_original] = []
-
-        tabulated_data[question][process][model].append(line)
-        question, model, process, prompt, response, normal_query, valid_query, error, correct, icon, message = get_item(
-            line)
-        # increase number of icons in statistics
-        if icon not in statistics[model][process]:
-            statistics[model][process][icon] = 0
-        statistics[model][process][icon] += 1
-
-        if ICON_MASK not in statistics[model][process]:
-            statistics[model][process][ICON_MASK] = 0
-        statistics[model][process][ICON_MASK] += 1 if line['wikidata_uri_in_masked'] else 0
-
-        if ICON_SPARQL_QUERY_INCORRECT not in statistics_extra[model][process]:
-            statistics_extra[model][process][ICON_SPARQL_QUERY_INCORRECT] = 0
-
-        # if line['wikidata_uri_in_masked']:
-        #     statistics_extra[model][process][ICON_MASK] += 1
-
-        if icon == ICON_NOT_VALID:
-            # check if normal_query contains SELECT or ASK
-            if normal_query == None:
-                pass
-            elif not check_sparql_query(normal_query):
-                statistics_extra[model][process][ICON_SPARQL_QUERY_INCORRECT] += 1
-
-                # display statistics
-
-                # for each process in a column
-    process_columns = st.columns(len(PROCESSES)+1, border=True)
-    with process_columns[0]:
-        st.subheader("Statistics")
-
-    for j, process in enumerate(PROCESSES):
-        with process_columns[j+1]:
-            st.subheader(f"{process}")
-
-    # for each process in a column
-    for model in tabulated_data_rows_ids:
+    # questions in order of their first appearance, with the row ids per process and model
+    with METRICS.span("ui.index"):
+        index = lazy_data[file].index
+
+    # faceted filters and search: the shown questions and rows come from the matching row ids
+    matches = record_filter(lazy_data[file].search)
+    questions = None if matches is None else index.matching(columns, matches)
+    # the table and the details test every row id against the matches
+    matches = None if matches is None else set(matches.tolist())
+    max_questions = len(index) if questions is None else len(questions)
+    if not max_questions:
+        st.warning("No records match the filters")
+
+    # a slider needs two values at least, a filter may leave fewer
+    number_of_questions, first_question = max_questions, 0
+    if max_questions > 1:
+        number_of_questions = st.sidebar.slider(
+            "Show this number of questions", 1, max_questions, min(50, max_questions))
+
+        first_question = st.sidebar.slider(
+            "ID of first question to be shown", 0, max_questions - 1,
+            min(50, max_questions - 1) if questions is None else 0)
+
+    # display statistics
+
+    with METRICS.span("ui.statistics_grid"):
+        # for each process in a column
         process_columns = st.columns(len(PROCESSES)+1, border=True)
         with process_columns[0]:
-            st.write(f"{model}")
+            st.subheader("Statistics")
 
         for j, process in enumerate(PROCESSES):
             with process_columns[j+1]:
-                # icons = statistics[model][process].keys()
-                # sort icons
-                # icons = sorted(icons)
-                count = 0
-                for icon in icons:
-                    if icon not in statistics[model][process]:
-                        statistics[model][process][icon] = 0
-                    else:
-                        count += statistics[model][process][icon]
-
-                left_statistics, right_statistics = st.columns(2)
-                with left_statistics:
-                    for icon in icons:
-                        st.write(
-                            f"{icon} : {statistics[model][process][icon]} → {statistics[model][process][icon]/count:.1%}")
-                    st.write(f"{ICON_MASK} : {statistics[model][process][ICON_MASK]}")
-                    st.write(f"= {count}")
-                    st.write(
-                        f"{ICON_SPARQL_QUERY_INCORRECT} SELECT OR ASK missing: {statistics_extra[model][process][ICON_SPARQL_QUERY_INCORRECT]}")
-                    st.write(f'')
-                with right_statistics:
-                    # plot the data
-                    fig, ax = plt.subplots()
-
-                    chart_values = {}
-                    for icon in icons:
-                        chart_values[icon] = statistics[model][process][icon]
-                        # chart_values = statistics[model][process]
-                    # sort by keys to have the same order in the chart
-                    # chart_values = dict(sorted(chart_values.items()))
-
-                    values = chart_values.values()
-                    # fix zero values in the dict_values to avoid error in the chart
-                    values = [v if v > 0 else 0.000001 for v in values]
-
-                    labels = chart_values.keys()
-                    # define colors for each icon in the chart
-                    # colors = ['gold', 'green', 'red']
-                    colors = ['green', 'gold', 'red',]
-
-                    try:
-                        explode = (0, 0.15, 0)
-                        ax.pie(values, labels=labels, autopct='%1.1f%%',
-                               colors=colors, textprops={'fontsize': 18}, explode=explode)
-                        st.pyplot(fig)
-                    except:
-                        explode = None
-                        ax.pie(values, labels=labels, autopct='%1.1f%%',
-                               colors=colors, textprops={'fontsize': 18}, explode=explode)
-                        st.pyplot(fig)
-
-    process_columns = st.columns(len(PROCESSES)+1, border=True)
-    with process_columns[0]:
-        st.write("total:")
-
-    for j, process in enumerate(PROCESSES):
-        with process_columns[j+1]:
-            total = 0
-            for model in tabulated_data_rows_ids:
-                for icon in statistics[model][process]:
-                    total += statistics[model][process][icon]
-            st.write(f"= {total}")
-
-    # remove all data before the question at position first_question
-    for i in range(first_question-1):
-        tabulated_data.pop(i, None)
-
-    # data = data[:number_of_experiments_per_question * number_of_experiments]
-    tabulated_data = dict(list(tabulated_data.items())[:number_of_questions])
-
-    # display data in table
-    for i, question in enumerate(tabulated_data):
-        st.subheader(f"Question {i + first_question}: {question}")
-        number_of_columns = len(PROCESSES) + 1
-
-        process_columns = st.columns(number_of_columns, border=True)
-
-        with process_columns[0]:
-            on_all = st.toggle(
-                "show all details of this question", key=question)
-
-        # show the process names
-        for j, process in enumerate(PROCESSES):
-            with process_columns[j+1]:
-                st.write(process)
-
-        # show results for each model
-        if process not in tabulated_data[question]:
-            st.write(f"No data: {question} {process}")
-            with st.expander("Details", icon=ICON_ERROR):
-                st.code(json.dumps(tabulated_data[question], indent=2))
+                st.subheader(f"{process}")
 
+        # for each process in a column
         for model in tabulated_data_rows_ids:
-            process_columns = st.columns(number_of_columns, border=True)
+            process_columns = st.columns(len(PROCESSES)+1, border=True)
             with process_columns[0]:
-                # show the short process results
-                short_results = ""
-                # for process in tabulated_data[question]:
-                #     icon, message = get_prepared_results(line)
-                #     short_results += f"{icon}"
-                left_column = st.columns(2)
-                left_column[0].write(model)
-                with left_column[1]:
-                    # a button to show the complete results
-                    on = st.toggle("show details", key=question+model)
-                # st.write(model + " : " + short_results)
+                st.write(f"{model}")
 
             for j, process in enumerate(PROCESSES):
                 with process_columns[j+1]:
-                    if process not in tabulated_data[question]:
-                        st.write(
-                            f"No process data found: {question} {process}")
-                        # show the details with error icon
-                        with st.expander("Details", icon=ICON_ERROR):
-                            st.code(json.dumps(
-                                tabulated_data[question], indent=2))
-                        continue
+                    outcome_counts = statistics.outcome_counts(model, process)
+                    count = sum(outcome_counts[icon] for icon in icons)
 
-                    if model not in tabulated_data[question][process]:
+                    for icon in icons:
                         st.write(
-                            f"No model data found: {question} {process} {model}", icon=ICON_ERROR)
-                        with st.expander("Details"):
-                            st.code(
-                                json.dumps(tabulated_data[question][process], indent=2))
-                        continue
-
-                    for line in tabulated_data[question][process][model]:
-                        question, model, process, prompt, response, normal_query, valid_query, error, correct, icon, message = get_item(
-                            line)
-
-                        if on == False and on_all == False:
-                            if icon == ICON_NOT_VALID and not check_sparql_query(normal_query):
-                                st.write(icon + ICON_SPARQL_QUERY_INCORRECT)
-                            else:
-                                st.write(icon)
-                            continue
-
-                        st.code(prompt, language="text", wrap_lines=True)
+                            f"{icon} : {outcome_counts[icon]} → {outcome_counts[icon]/max(count, 1):.1%}")
+                    st.write(
+                        f"{ICON_MASK} : {statistics.flag_count('wikidata_uri_in_masked', model, process)}")
+                    st.write(f"= {count}")
+                    st.write(
+                        f"{ICON_SPARQL_QUERY_INCORRECT} SELECT OR ASK missing: {statistics.flag_count('sparql_query_incorrect', model, process)}")
+                    mean_f1 = statistics.mean_f1(model, process)
+                    if mean_f1 is not None:
+                        st.write(
+                            f"F1 (partial credit): {mean_f1:.1%} of {statistics.flag_count('scored', model, process)} answered")
 
-                        with st.expander(f"{icon} Response Details: {message} <br>// error: {error} // valid_query: {valid_query} // correct: {correct}"):
-                            st.write(
-                                f"Eval: Error: {error}, valid_query: {valid_query}, correct: {correct}")
-                            st.code(response, language="json")
+        process_columns = st.columns(len(PROCESSES)+1, border=True)
+        with process_columns[0]:
+            st.write("total:")
 
-                        st.write("Generated Query (`normal_query`):")
-                        # quick format of the SPARQL query while adding line breaks
-                        normal_query = normal_query.replace("SELECT", "\nSELECT").replace(
-                            "WHERE", "\nWHERE").replace("FILTER", "\nFILTER").replace("OPTIONAL", "\nOPTIONAL").replace("UNION", "\nUNION").replace("LIMIT", "\nLIMIT").replace("ORDER BY", "\nORDER BY")
-                        if not check_sparql_query(normal_query):
-                            st.write(ICON_SPARQL_QUERY_INCORRECT)
+        for j, process in enumerate(PROCESSES):
+            with process_columns[j+1]:
+                st.write(f"= {statistics.process_total(process)}")
+        METRICS.count("widgets", (len(tabulated_data_rows_ids) + 2) * (len(PROCESSES) + 1))
+
+    # plot the data: one figure for all models and processes, only redrawn when the counts change
+    with METRICS.span("ui.charts"), st.expander("Charts", expanded=True):
+        chart_values = tuple(
+            tuple(tuple(statistics.outcome_counts(model, process)[icon] for icon in icons)
+                  for process in PROCESSES)
+            for model in tabulated_data_rows_ids)
+        st.image(outcome_pies(chart_values, tuple(tabulated_data_rows_ids), tuple(PROCESSES)),
+                 use_container_width=True)
+        METRICS.count("widgets")
+
+    # accuracy per benchmark template or recursion depth, joined through the question of every row
+    with METRICS.span("ui.breakdown"), st.expander("Accuracy by benchmark field"):
+        field = st.radio("Group by", ["recursionDepth", "questionTemplate"], horizontal=True)
+        st.dataframe(breakdown(columns, get_benchmark_index(), field),
+                     hide_index=True, use_container_width=True)
+        METRICS.count("widgets", 2)
+
+    if compare_with:
+        with METRICS.span("ui.comparison"), st.expander("Comparison", expanded=True):
+            show_comparison(file, compare_with)
+
+    # compact results of the shown questions as a single table
+    with METRICS.span("ui.summary_table"):
+        if questions is None:
+            page = index.page(first_question, number_of_questions)
+        else:
+            page = questions[first_question:first_question + number_of_questions]
+        st.dataframe(summary_table(columns, index, page, tabulated_data_rows_ids, matches),
+                     hide_index=True, use_container_width=True)
+        METRICS.count("widgets")
 
-                        st.code(normal_query)
-                        # collapse accordion to show details
-                        with st.expander("Details"):
-                            st.code(json.dumps(line, indent=2),
-                                    language="json")
+    # details are only built for the questions whose toggle is on
+    with METRICS.span("ui.details"):
+        for i, question in page:
+            on = st.toggle(f"Question {i}: {question}", key=f"{file}-{i}")
+            if on:
+                show_question_details(i, question, columns,
+                                      index, tabulated_data_rows_ids, matches)
+        METRICS.count("widgets", len(page))
 
 
 if __name__ == "__main__":
-    main()
+    configure_metrics()
+    with METRICS.span("ui.rerun"):
+        main()
+    # unload the least recently used files beyond the memory budget
+    lazy_data.trim()
+    show_diagnostics()
@@ -0,0 +1 @@
+"""Loading, preprocessing and analysis of evaluation results for data-evaluator-ui.py"""
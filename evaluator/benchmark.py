@@ -0,0 +1,163 @@
+"""Join index between evaluation records and the MCWQ benchmark
+
+Evaluation records only carry the question text. The index keeps the join fields of every benchmark entry
+(id, template, recursion depth, gold query and answers, masks) with hash maps by id and by question text, the
+original as well as the optimized one (from the mapping file that links benchmarks/mcwq_optimized.json to
+the original entries). It is cached as a small JSON file and rebuilt only when the benchmark changes, so
+joins cost a dict lookup per distinct question instead of parsing the benchmark again.
+"""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from evaluator.columnar import OUTCOMES, file_signature
+from evaluator.instrumentation import METRICS
+from evaluator.preprocess import ICON_CORRECT
+
+BENCHMARK = "benchmarks/mcwq.json"
+OPTIMIZED_BENCHMARK = "benchmarks/mcwq_optimized.json"
+# links the entries of the optimized benchmark to the original ones
+MAPPING = "benchmarks/mcwq_optimized_mapping.json"
+CACHE_DIR = ".cache/benchmark"
+INDEX_VERSION = 1
+
+# fields of the benchmark entries kept in the index
+INDEX_FIELDS = ["id", "CFQquestionIdx", "questionTemplate", "recursionDepth", "expectedResponse", "sparql",
+                "results", "masks", "en"]
+
+
+def build_mapping(benchmark=BENCHMARK, optimized=OPTIMIZED_BENCHMARK):
+    """[{"id", "question", "optimized"}] for every entry of the optimized benchmark
+
+    Raises ValueError if an entry does not match an original entry by id and question.
+    """
+    with open(benchmark, "r", encoding="utf-8") as file:
+        originals = {entry["id"]: entry for entry in json.load(file)}
+    with open(optimized, "r", encoding="utf-8") as file:
+        entries = json.load(file)
+    mapping = []
+    for entry in entries:
+        original = originals.get(entry["id"])
+        if original is None or original["en"] != entry["en"]:
+            raise ValueError(f"optimized entry {entry['id']} has no original entry: {entry['en']}")
+        mapping.append({"id": entry["id"], "question": entry["en"], "optimized": entry.get("optimized")})
+    return mapping
+
+
+def write_mapping(path=MAPPING, benchmark=BENCHMARK, optimized=OPTIMIZED_BENCHMARK):
+    mapping = build_mapping(benchmark, optimized)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(mapping, file, ensure_ascii=False, indent=1)
+        file.write("\n")
+    return path
+
+
+class BenchmarkIndex:
+    """Benchmark entries with hash maps by id and by (original or optimized) question text"""
+
+    def __init__(self, entries, mapping=()):
+        self.entries = entries
+        self.by_id = {entry["id"]: position for position, entry in enumerate(entries)}
+        self.by_question = {entry["en"]: position for position, entry in enumerate(entries)}
+        for link in mapping:
+            position = self.by_id.get(link["id"])
+            if position is not None and link.get("optimized"):
+                entries[position]["optimized"] = link["optimized"]
+                self.by_question.setdefault(link["optimized"], position)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, question):
+        """Benchmark entry of a question or None"""
+        position = self.by_question.get(question)
+        return None if position is None else self.entries[position]
+
+    def positions(self, questions):
+        """Entry positions of a list of questions (e.g. an interned string table), -1 where unknown"""
+        return np.fromiter((self.by_question.get(question, -1) for question in questions), dtype=np.int64,
+                           count=len(questions))
+
+    def codes(self, field):
+        """Distinct values of a field and the code of every entry's value"""
+        values = sorted({entry.get(field) for entry in self.entries}, key=lambda value: (value is None, value))
+        codes = {value: code for code, value in enumerate(values)}
+        return values, np.asarray([codes[entry.get(field)] for entry in self.entries], dtype=np.int64)
+
+
+def _index_path(benchmark, cache_dir):
+    return Path(cache_dir) / f"{Path(benchmark).stem}.json"
+
+
+def load_benchmark_index(benchmark=BENCHMARK, mapping=MAPPING, cache_dir=CACHE_DIR):
+    """BenchmarkIndex of the benchmark (and mapping file, if it exists), from the cache if it is up to date"""
+    signature = {"benchmark": file_signature(benchmark),
+                 "mapping": file_signature(mapping) if os.path.exists(mapping) else None}
+    target = _index_path(benchmark, cache_dir)
+    try:
+        with open(target, "r", encoding="utf-8") as file:
+            cached = json.load(file)
+        if cached.get("version") == INDEX_VERSION and cached.get("signature") == signature:
+            METRICS.hit("benchmark_index", True)
+            return BenchmarkIndex(cached["entries"], cached["mapping"])
+    except (FileNotFoundError, ValueError):
+        pass
+
+    METRICS.hit("benchmark_index", False)
+    with open(benchmark, "r", encoding="utf-8") as file:
+        entries = [{field: entry.get(field) for field in INDEX_FIELDS} for entry in json.load(file)]
+    links = []
+    if signature["mapping"] is not None:
+        with open(mapping, "r", encoding="utf-8") as file:
+            links = json.load(file)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open(target.with_suffix(".tmp"), "w", encoding="utf-8") as file:
+        json.dump({"version": INDEX_VERSION, "signature": signature, "entries": entries, "mapping": links}, file,
+                  ensure_ascii=False)
+    os.replace(target.with_suffix(".tmp"), target)
+    return BenchmarkIndex(entries, links)
+
+
+def breakdown(columns, index, field):
+    """Accuracy per value of a benchmark field (e.g. questionTemplate, recursionDepth) and model
+
+    Rows are joined to the benchmark through their question code, one lookup per distinct question. Returns
+    a list of rows for a table; rows whose question is not in the benchmark are grouped under None.
+    """
+    values, codes = index.codes(field)
+    # the last code stands for questions that are not in the benchmark
+    codes = np.append(codes, len(values))
+    values = values + [None]
+    row_values = codes[index.positions(columns.strings["question"])[columns["question"]]]
+
+    models = columns.strings["model"]
+    cell = row_values * len(models) + columns["model"]
+    size = len(values) * len(models)
+    total = np.bincount(cell, minlength=size)
+    correct = np.bincount(cell, weights=columns["outcome"] == OUTCOMES.index(ICON_CORRECT), minlength=size)
+    f1 = np.asarray(columns["f1"], dtype=np.float64)
+    scored = np.bincount(cell, weights=~np.isnan(f1), minlength=size)
+    f1_sums = np.bincount(cell, weights=np.nan_to_num(f1), minlength=size)
+
+    rows = []
+    for value_code, value in enumerate(values):
+        for model_code, model in enumerate(models):
+            i = value_code * len(models) + model_code
+            if not total[i]:
+                continue
+            rows.append({
+                field: value,
+                "Model": model,
+                "Rows": int(total[i]),
+                "Correct": int(correct[i]),
+                "Accuracy": float(correct[i] / total[i]),
+                "Mean F1": float(f1_sums[i] / scored[i]) if scored[i] else None,
+            })
+    return rows
+
+
+if __name__ == "__main__":
+    # regenerates the mapping file: python -m evaluator.benchmark
+    print(f"{OPTIMIZED_BENCHMARK} -> {write_mapping()}")
@@ -0,0 +1,40 @@
+"""Charts of the evaluation statistics"""
+import io
+from functools import lru_cache
+
+from matplotlib.figure import Figure
+
+# labels and colors of the outcomes correct, incorrect, not valid (matplotlib's fonts have no emoji)
+OUTCOME_LABELS = ['correct', 'incorrect', 'not valid']
+OUTCOME_COLORS = ['green', 'gold', 'red']
+
+
+@lru_cache(maxsize=32)
+def outcome_pies(counts, models, processes, labels=tuple(OUTCOME_LABELS), colors=tuple(OUTCOME_COLORS)):
+    """PNG of one figure with an outcome pie per model (rows) and process (columns)
+
+    counts is a nested tuple counts[model][process][outcome]; the result is memoized on it, so a chart is only
+    drawn when the underlying numbers change. The figure is not registered with pyplot and is released as soon
+    as it has been saved.
+    """
+    fig = Figure(figsize=(3 * len(processes), 3 * len(models)))
+    axes = fig.subplots(len(models), len(processes), squeeze=False)
+    for row, model in enumerate(models):
+        for column, process in enumerate(processes):
+            ax = axes[row][column]
+            values = counts[row][column]
+            if not any(values):
+                ax.text(0.5, 0.5, "no data", ha="center", va="center")
+                ax.axis("off")
+                continue
+            # fix zero values to avoid errors in the chart
+            values = [v if v > 0 else 0.000001 for v in values]
+            explode = [0.15 if i == 1 else 0 for i in range(len(values))]
+            ax.pie(values, labels=labels, autopct='%1.1f%%', colors=colors[:len(values)],
+                   textprops={'fontsize': 10}, explode=explode)
+            ax.set_title(f"{model} / {process}", fontsize=10)
+    fig.tight_layout()
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    fig.clear()
+    return buffer.getvalue()
@@ -0,0 +1,408 @@
+"""Columnar on-disk cache of evaluation JSONL files
+
+Compiling a file parses and preprocesses every record once and stores the fields needed by the evaluator
+as NumPy arrays (one .npy file per column) plus a table of interned strings. Loading memory-maps the
+arrays, so opening a compiled file is near-instant and the pages are shared between processes.
+
+Heavy text fields (prompt, response, normal_query, ...) are not copied: each row keeps the byte offsets of
+its line in the memory-mapped source file, which is decoded only when the full record is needed.
+
+Evaluation jobs append to their files while they run. The cache remembers how far the file has been read,
+so only appended lines are parsed, both when loading and when refreshing a loaded file.
+"""
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from evaluator.instrumentation import METRICS
+from evaluator.preprocess import (ICON_CORRECT, ICON_ERROR, ICON_INCORRECT, ICON_NOT_VALID,
+                                  check_sparql_query, get_prepared_results, preprocess)
+from evaluator.scoring import answer_metrics
+
+CACHE_VERSION = 5
+CACHE_DIR = ".cache/eval"
+
+# code tables of the categorical columns
+OUTCOMES = [ICON_CORRECT, ICON_INCORRECT, ICON_NOT_VALID, ICON_ERROR]
+QUERY_TYPES = [None, "ASK", "SELECT"]
+# valid_query and correct are true, false or missing
+TRISTATE = {None: -1, False: 0, True: 1}
+
+# columns holding codes into the interned string tables
+STRING_COLUMNS = ["question", "model", "process"]
+# bytes before the consumed offset that are compared on refresh to detect a rewritten file
+TAIL_BYTES = 256
+
+COLUMN_DTYPES = {
+    "question": np.int32,
+    "model": np.int32,
+    "process": np.int32,
+    "outcome": np.int8,
+    "valid_query": np.int8,
+    "correct": np.int8,
+    "has_error": np.bool_,
+    "multiple_clause": np.bool_,
+    "wikidata_uri_in_masked": np.bool_,
+    "has_normal_query": np.bool_,
+    # normal_query is present but contains neither SELECT nor ASK
+    "sparql_query_incorrect": np.bool_,
+    "expected_type": np.int8,
+    "predicted_type": np.int8,
+    # partial credit of predicted against gold answers, NaN where the record has no answers
+    "precision": np.float32,
+    "recall": np.float32,
+    "f1": np.float32,
+    # error_extra messages of row i are error_extra[error_extra_offsets[i]:error_extra_offsets[i + 1]]
+    "error_extra_offsets": np.int64,
+    "error_extra": np.int32,
+    # byte range of the record's line in the source file
+    "line_start": np.int64,
+    "line_end": np.int64,
+}
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def file_hash(path, length=None):
+    """SHA-1 of the file, or of its first length bytes"""
+    digest = hashlib.sha1()
+    remaining = os.path.getsize(path) if length is None else length
+    with open(path, "rb") as file:
+        while remaining > 0:
+            block = file.read(min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def cache_path(source, cache_dir=CACHE_DIR):
+    return Path(cache_dir) / Path(source).name
+
+
+class StringTable:
+    """Interns strings into consecutive integer codes"""
+
+    def __init__(self, strings=()):
+        self.strings = list(strings)
+        self.codes = {string: code for code, string in enumerate(self.strings)}
+
+    def code(self, string):
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+
+def record_columns(record, tables):
+    """Values of the non-offset columns for one preprocessed record"""
+    icon, _ = get_prepared_results(record)
+    normal_query = record.get("normal_query")
+    return {
+        "question": tables["question"].code(record.get("question")),
+        "model": tables["model"].code(record.get("model")),
+        "process": tables["process"].code(record.get("process")),
+        "outcome": OUTCOMES.index(icon),
+        "valid_query": TRISTATE.get(record.get("valid_query"), -1),
+        "correct": TRISTATE.get(record.get("correct"), -1),
+        "has_error": record.get("error") is not None,
+        "multiple_clause": record.get("multiple_clause", False),
+        "wikidata_uri_in_masked": record.get("wikidata_uri_in_masked", False),
+        "has_normal_query": normal_query is not None,
+        "sparql_query_incorrect": normal_query is not None and not check_sparql_query(normal_query),
+        "expected_type": QUERY_TYPES.index(record.get("expected_type")),
+        "predicted_type": QUERY_TYPES.index(record.get("predicted_type")),
+    }
+
+
+def parse_lines(file, start, tables):
+    """Parses and preprocesses the complete lines of file from byte offset start on
+
+    Returns the column values of the parsed rows, the number of error_extra messages of every row and the
+    offset up to which the file was consumed. A last line that is cut off (still being written) is left
+    for the next call.
+    """
+    values = {name: [] for name in COLUMN_DTYPES if name != "error_extra_offsets"}
+    error_extra_counts = []
+    predicted = []
+    gold = []
+    file.seek(start)
+    offset = start
+    for line in file:
+        line_start, line_end = offset, offset + len(line)
+        if line.strip():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if line.endswith(b"\n"):
+                    raise
+                # incomplete last line
+                break
+            preprocess(record)
+            for name, value in record_columns(record, tables).items():
+                values[name].append(value)
+            values["error_extra"].extend(tables["error_extra"].code(message) for message in record["error_extra"])
+            error_extra_counts.append(len(record["error_extra"]))
+            predicted.append(record.get("predicted"))
+            gold.append(record.get("gold"))
+            values["line_start"].append(line_start)
+            values["line_end"].append(line_end)
+        offset = line_end
+    # the answers of all parsed rows are compared at once
+    metrics = answer_metrics(predicted, gold)
+    for name in ("precision", "recall", "f1"):
+        values[name] = metrics[name]
+    return values, error_extra_counts, offset
+
+
+def _replace(path, write):
+    # a unique temporary file per writer, other processes or threads may compile the same cache at the same
+    # time; replace instead of overwriting, they may also have the old file memory-mapped
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name, suffix=".tmp", delete=False) as file:
+        try:
+            write(file)
+        except BaseException:
+            file.close()
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+def _save_array(path, array):
+    _replace(path, lambda file: np.save(file, array))
+
+
+def _save_meta(target, meta):
+    _replace(target / "meta.json", lambda file: file.write(json.dumps(meta, ensure_ascii=False).encode("utf-8")))
+
+
+def save_columns(columns, cache_dir=CACHE_DIR):
+    """Writes the columnar cache of an EvalColumns, returns the cache path
+
+    The metadata is replaced last, so readers see either the old or the new one. Until then they may find
+    arrays longer than the old metadata, _open_columns only reads its rows of them.
+    """
+    target = cache_path(columns.source, cache_dir)
+    target.mkdir(parents=True, exist_ok=True)
+    for name in COLUMN_DTYPES:
+        _save_array(target / f"{name}.npy", np.ascontiguousarray(columns[name]))
+    _save_meta(target, {
+        "version": CACHE_VERSION,
+        "source": str(columns.source),
+        "signature": file_signature(columns.source),
+        "consumed": columns.consumed,
+        "hash": file_hash(columns.source, columns.consumed),
+        "rows": len(columns),
+        "strings": columns.strings,
+    })
+    return target
+
+
+def compile_eval_file(source, cache_dir=CACHE_DIR):
+    """Parses and preprocesses a JSONL evaluation file and writes its columnar cache, returns the cache path"""
+    columns = EvalColumns.empty(source)
+    columns.refresh()
+    return save_columns(columns, cache_dir)
+
+
+def read_meta(target):
+    try:
+        with open(target / "meta.json", "r", encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def cache_state(source, meta):
+    """"valid" if the cache matches the file, "appended" if lines were only added since, else "stale"
+
+    Size and mtime are checked first, the hash of the consumed part of the file only if they changed.
+    """
+    if meta is None or meta.get("version") != CACHE_VERSION:
+        return "stale"
+    signature = file_signature(source)
+    if signature == meta["signature"]:
+        return "valid"
+    if signature["size"] < meta["consumed"] or file_hash(source, meta["consumed"]) != meta["hash"]:
+        return "stale"
+    return "valid" if signature["size"] == meta["signature"]["size"] else "appended"
+
+
+def _open_columns(source, target, meta):
+    """EvalColumns of the cache in target, None if its arrays don't hold the rows of meta"""
+    if meta is None:
+        return None
+    rows = meta["rows"]
+    try:
+        arrays = {name: np.load(target / f"{name}.npy", mmap_mode="r") for name in COLUMN_DTYPES}
+    except (FileNotFoundError, ValueError):
+        return None
+    # appending only extends the arrays and string tables, arrays written after meta are cut to its rows
+    lengths = {name: rows for name in COLUMN_DTYPES}
+    lengths["error_extra_offsets"] = rows + 1
+    if len(arrays["error_extra_offsets"]) < rows + 1:
+        return None
+    lengths["error_extra"] = int(arrays["error_extra_offsets"][rows])
+    if any(len(arrays[name]) < length for name, length in lengths.items()):
+        return None
+    columns = {name: array[:lengths[name]] for name, array in arrays.items()}
+    return EvalColumns(source, columns, meta["strings"], meta["consumed"])
+
+
+def load_eval_file(source, cache_dir=CACHE_DIR):
+    """Returns the EvalColumns of a JSONL evaluation file, (re)compiling its cache if needed
+
+    If lines were only appended since the cache was written, just the new lines are parsed.
+    """
+    target = cache_path(source, cache_dir)
+    meta = read_meta(target)
+    state = cache_state(source, meta)
+    # a cache with appended lines counts as a hit, only the new lines are parsed
+    METRICS.hit("columnar", state != "stale")
+    eval_columns = None if state == "stale" else _open_columns(source, target, meta)
+    if eval_columns is None:
+        eval_columns = EvalColumns.empty(source)
+        eval_columns.refresh()
+        save_columns(eval_columns, cache_dir)
+        # memory-map the written cache, unless another writer replaced it in the meantime
+        meta = read_meta(target)
+        if meta is not None and meta["consumed"] == eval_columns.consumed \
+                and meta["hash"] == file_hash(source, eval_columns.consumed):
+            eval_columns = _open_columns(source, target, meta) or eval_columns
+        return eval_columns
+    if state == "appended":
+        eval_columns.refresh()
+        save_columns(eval_columns, cache_dir)
+    elif meta["signature"] != file_signature(source):
+        # same content with a new mtime (e.g. after a checkout), remember the new signature
+        meta["signature"] = file_signature(source)
+        _save_meta(target, meta)
+    return eval_columns
+
+
+class EvalColumns:
+    """Columnar view of one evaluation file, backed by memory-mapped arrays
+
+    refresh() appends the lines added to the file since it was read. The columns are then copied into
+    growable in-memory arrays, so appending costs time proportional to the new lines only.
+    """
+
+    def __init__(self, source, columns, strings, consumed):
+        self.source = source
+        self._buffers = dict(columns)
+        self._lengths = {name: len(array) for name, array in columns.items()}
+        self.tables = {name: StringTable(strings[name]) for name in STRING_COLUMNS + ["error_extra"]}
+        # the lists of the string tables, they grow with the tables
+        self.strings = {name: table.strings for name, table in self.tables.items()}
+        # offset up to which the source file has been read
+        self.consumed = consumed
+        self._map = None
+        # last bytes of the consumed part, they differ if the file was rewritten
+        self._tail = b""
+        if consumed:
+            with open(source, "rb") as file:
+                self._tail = self._read_tail(file)
+
+    @classmethod
+    def empty(cls, source):
+        columns = {name: np.zeros(0, dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+        columns["error_extra_offsets"] = np.zeros(1, dtype=COLUMN_DTYPES["error_extra_offsets"])
+        return cls(source, columns, {name: [] for name in STRING_COLUMNS + ["error_extra"]}, 0)
+
+    def __len__(self):
+        return self._lengths["line_start"]
+
+    def __getitem__(self, name):
+        return self._buffers[name][:self._lengths[name]]
+
+    def _append(self, name, values):
+        values = np.asarray(values, dtype=COLUMN_DTYPES[name])
+        buffer = self._buffers[name]
+        length = self._lengths[name]
+        needed = length + len(values)
+        if needed > len(buffer) or not buffer.flags.writeable:
+            # memory-mapped or full: copy into a larger buffer, doubling keeps appends amortized O(1)
+            grown = np.empty(max(needed, 2 * length, 1024), dtype=buffer.dtype)
+            grown[:length] = buffer[:length]
+            self._buffers[name] = buffer = grown
+        buffer[length:needed] = values
+        self._lengths[name] = needed
+
+    def _read_tail(self, file):
+        start = max(0, self.consumed - TAIL_BYTES)
+        file.seek(start)
+        return file.read(self.consumed - start)
+
+    def refresh(self):
+        """Reads lines appended to the source file, returns the first new row or None if the file was rewritten
+
+        The file counts as rewritten if it is shorter than the consumed part or the last bytes of that part
+        changed, so a rewrite that already grew past the old offset is not parsed from the middle of a line.
+        """
+        size = os.path.getsize(self.source)
+        if size < self.consumed:
+            self._map = None
+            return None
+        first_row = len(self)
+        with open(self.source, "rb") as file:
+            if self._read_tail(file) != self._tail:
+                self._map = None
+                return None
+            if size == self.consumed:
+                return first_row
+            values, error_extra_counts, consumed = parse_lines(file, self.consumed, self.tables)
+            if consumed == self.consumed:
+                return first_row
+            self.consumed = consumed
+            self._tail = self._read_tail(file)
+        for name, column_values in values.items():
+            self._append(name, column_values)
+        offsets = self["error_extra_offsets"][-1] + np.cumsum(error_extra_counts, dtype=np.int64)
+        self._append("error_extra_offsets", offsets)
+        return first_row
+
+    def _source_map(self):
+        """Read-only memory map of the consumed part of the source file, remapped when the file has grown"""
+        if self._map is None or len(self._map) < self.consumed:
+            with open(self.source, "rb") as file:
+                self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map
+
+    def line(self, row):
+        """Raw JSON line of a row"""
+        return self._source_map()[int(self["line_start"][row]):int(self["line_end"][row])]
+
+    def error_extra(self, row):
+        offsets = self["error_extra_offsets"]
+        codes = self["error_extra"][offsets[row]:offsets[row + 1]]
+        return [self.strings["error_extra"][code] for code in codes]
+
+    def record(self, row):
+        """Full record of a row: decoded from the source file, with the derived fields from the cache"""
+        METRICS.count("records_decoded")
+        record = json.loads(self.line(row))
+        record["error_extra"] = self.error_extra(row)
+        record["multiple_clause"] = bool(self["multiple_clause"][row])
+        record["wikidata_uri_in_masked"] = bool(self["wikidata_uri_in_masked"][row])
+        record["expected_type"] = QUERY_TYPES[self["expected_type"][row]]
+        record["predicted_type"] = QUERY_TYPES[self["predicted_type"][row]]
+        record["id"] = row
+        return record
+
+
+if __name__ == "__main__":
+    import sys
+
+    # compile step: python -m evaluator.columnar data/*-eval.jsonl
+    for source in sys.argv[1:]:
+        print(f"{source} -> {compile_eval_file(source)}")
@@ -0,0 +1,119 @@
+"""Comparison of evaluation files, e.g. the original against the optimized questions
+
+Rows of two files are aligned by question, model and process (and by occurrence, should a combination repeat)
+on integer keys in a shared code space, so alignment, per cell outcome counts and flip matrices of a pair of
+files are a few vectorized operations on the columns.
+"""
+import numpy as np
+
+from evaluator.columnar import OUTCOMES, STRING_COLUMNS
+from evaluator.preprocess import ICON_CORRECT
+
+
+def _union_codes(base, other):
+    """Union of the string tables of two files and the codes of both in it, per string column"""
+    strings = {}
+    codes = {}
+    for name in STRING_COLUMNS:
+        union = list(base.strings[name])
+        positions = {string: code for code, string in enumerate(union)}
+        for string in other.strings[name]:
+            if string not in positions:
+                positions[string] = len(union)
+                union.append(string)
+        strings[name] = union
+        codes[name] = (np.arange(len(base.strings[name]), dtype=np.int64),
+                       np.asarray([positions[string] for string in other.strings[name]], dtype=np.int64))
+    return strings, codes
+
+
+def _occurrence(keys):
+    """Number of earlier rows with the same key, for every row"""
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    ranks = np.arange(len(keys)) - np.repeat(starts, np.diff(np.r_[starts, len(keys)]))
+    occurrence = np.empty(len(keys), dtype=np.int64)
+    occurrence[order] = ranks
+    return occurrence
+
+
+class Comparison:
+    """Aligned rows of a base and an other file with per model × process outcome counts and flip matrices
+
+    base_counts and other_counts have the shape (models, processes, outcomes) and count the aligned rows
+    only, flips has the shape (models, processes, base outcome, other outcome).
+    """
+
+    def __init__(self, base, other):
+        strings, codes = _union_codes(base, other)
+        self.models = strings["model"]
+        self.processes = strings["process"]
+        sizes = [len(strings[name]) for name in STRING_COLUMNS]
+
+        def keys(columns, side):
+            key = np.zeros(len(columns), dtype=np.int64)
+            for name, size in zip(STRING_COLUMNS, sizes):
+                key = key * size + codes[name][side][columns[name]]
+            return key
+
+        base_keys, other_keys = keys(base, 0), keys(other, 1)
+        # repeated question/model/process combinations are aligned in file order
+        repeats = max(1, len(base), len(other))
+        _, self.base_rows, self.other_rows = np.intersect1d(
+            base_keys * repeats + _occurrence(base_keys), other_keys * repeats + _occurrence(other_keys),
+            assume_unique=True, return_indices=True)
+        self.base_only = len(base) - len(self.base_rows)
+        self.other_only = len(other) - len(self.other_rows)
+
+        models = codes["model"][0][base["model"][self.base_rows]]
+        processes = codes["process"][0][base["process"][self.base_rows]]
+        base_outcomes = np.asarray(base["outcome"][self.base_rows], dtype=np.int64)
+        other_outcomes = np.asarray(other["outcome"][self.other_rows], dtype=np.int64)
+        outcomes = len(OUTCOMES)
+        shape = (len(self.models), len(self.processes), outcomes, outcomes)
+        cell = ((models * shape[1] + processes) * outcomes + base_outcomes) * outcomes + other_outcomes
+        self.flips = np.bincount(cell, minlength=int(np.prod(shape))).reshape(shape)
+        self.base_counts = self.flips.sum(axis=3)
+        self.other_counts = self.flips.sum(axis=2)
+
+    def __len__(self):
+        return len(self.base_rows)
+
+    def accuracy(self):
+        """Share of correct aligned rows per model × process for base and other, NaN for empty cells"""
+        correct = OUTCOMES.index(ICON_CORRECT)
+        totals = self.base_counts.sum(axis=2)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return self.base_counts[..., correct] / totals, self.other_counts[..., correct] / totals
+
+    def delta_table(self):
+        """One row per model and process with the outcome counts of both files and the accuracy delta"""
+        base_accuracy, other_accuracy = self.accuracy()
+        rows = []
+        for m, model in enumerate(self.models):
+            for p, process in enumerate(self.processes):
+                if not self.base_counts[m, p].sum():
+                    continue
+                row = {"Model": model, "Process": process, "Rows": int(self.base_counts[m, p].sum())}
+                for o, icon in enumerate(OUTCOMES):
+                    row[f"{icon} Δ"] = int(self.other_counts[m, p, o] - self.base_counts[m, p, o])
+                row["Accuracy"] = float(base_accuracy[m, p])
+                row["Accuracy (other)"] = float(other_accuracy[m, p])
+                row["Δ Accuracy"] = float(other_accuracy[m, p] - base_accuracy[m, p])
+                rows.append(row)
+        return rows
+
+    def flip_matrix(self, model=None, process=None):
+        """Outcome flips (base outcome → other outcome) of one model/process, summed over the others if None"""
+        flips = self.flips
+        if model is not None:
+            flips = flips[[self.models.index(model)]]
+        if process is not None:
+            flips = flips[:, [self.processes.index(process)]]
+        return flips.sum(axis=(0, 1))
+
+
+def compare(files):
+    """Comparison of the first file against each of the others, files being a list of EvalColumns"""
+    return [Comparison(files[0], other) for other in files[1:]]
@@ -0,0 +1,265 @@
+"""Evaluation files with lazily computed statistics and question index
+
+The compute core of the evaluator UI and the report CLI: nothing here depends on Streamlit or has side
+effects on import.
+"""
+import json
+import mmap
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from evaluator.columnar import CACHE_DIR, load_eval_file
+from evaluator.index import QuestionIndex
+from evaluator.instrumentation import METRICS
+from evaluator.search import RecordIndex
+from evaluator.statistics import Statistics
+
+DATA_DIR = "data"
+# memory budget of a DatasetCache in bytes
+MEMORY_BUDGET = 1024 * 1024 * 1024
+# a holder that was not seen for this many seconds no longer keeps its files loaded (e.g. a closed browser tab)
+HOLDER_TTL = 600
+
+
+def list_eval_files(directory=DATA_DIR):
+    """Names of the evaluation files (*-eval.jsonl) in a directory, sorted"""
+    return sorted(name for name in os.listdir(directory)
+                  if name.endswith("-eval.jsonl") and os.path.isfile(os.path.join(directory, name)))
+
+
+def deep_size(obj):
+    """Bytes of memory held by obj and everything it references, memory-mapped arrays and files count as 0"""
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, mmap.mmap, np.memmap)) or callable(obj):
+            continue
+        seen.add(id(obj))
+        if isinstance(obj, np.ndarray):
+            # views count with the array they are a view of
+            if obj.base is None:
+                size += obj.nbytes
+            else:
+                stack.append(obj.base)
+            continue
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(list(obj.keys()) + list(obj.values()))
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(list(obj))
+        elif hasattr(obj, "__dict__"):
+            stack.append(vars(obj))
+        elif hasattr(obj, "__slots__"):
+            stack.extend(getattr(obj, name) for name in obj.__slots__ if hasattr(obj, name))
+    return size
+
+
+class EvalFile:
+    """One evaluation file, loaded on first access; error holds the reason if loading failed"""
+
+    def __init__(self, file_name, cache_dir=CACHE_DIR):
+        self.file_name = file_name
+        self.cache_dir = cache_dir
+        self.error = None
+        self._columns = None
+        self._statistics = None
+        self._index = None
+        self._search = None
+        # (what was loaded, bytes, rows) of the last measurement
+        self._size = (None, 0, 0)
+        # an EvalFile is shared by threads (e.g. all sessions of the UI): loading, building the indexes and
+        # refresh must not run concurrently; reentrant, the indexes load the columns first
+        self._lock = threading.RLock()
+
+    def _load_columns(self):
+        self.error = None
+        try:
+            # memory-mapped columnar cache, compiled on first use or when the file changed
+            with METRICS.span("eval_file.load"):
+                self._columns = load_eval_file(self.file_name, self.cache_dir)
+            METRICS.count("rows_loaded", len(self._columns))
+        except FileNotFoundError:
+            self.error = f"File not found: {self.file_name}"
+        except json.JSONDecodeError as e:
+            self.error = f"Error decoding JSON: {e}"
+        except Exception as e:
+            self.error = f"An unexpected error occurred: {e}"
+
+    @property
+    def columns(self):
+        columns = self._columns
+        if columns is None:
+            # sessions may ask for a file at the same time, only the first one loads it
+            with self._lock:
+                if self._columns is None:
+                    self._load_columns()
+                columns = self._columns
+        return columns
+
+    @property
+    def statistics(self):
+        statistics = self._statistics
+        if statistics is None:
+            with self._lock:
+                if self._statistics is None and self.columns is not None:
+                    with METRICS.span("eval_file.statistics"):
+                        self._statistics = Statistics(self.columns)
+                statistics = self._statistics
+        return statistics
+
+    @property
+    def index(self):
+        index = self._index
+        if index is None:
+            with self._lock:
+                if self._index is None and self.columns is not None:
+                    with METRICS.span("eval_file.index"):
+                        self._index = QuestionIndex(self.columns)
+                index = self._index
+        return index
+
+    @property
+    def search(self):
+        """Inverted index of the rows by facet value and question token"""
+        search = self._search
+        if search is None:
+            with self._lock:
+                if self._search is None and self.columns is not None:
+                    with METRICS.span("eval_file.search"):
+                        self._search = RecordIndex(self.columns)
+                search = self._search
+        return search
+
+    def loaded(self):
+        return self._columns is not None
+
+    def nbytes(self):
+        """Memory held by the loaded parts
+
+        Measured again only after something was loaded or unloaded, appended rows are estimated with the
+        bytes per row of the last measurement, so following a growing file stays cheap.
+        """
+        columns = self._columns
+        rows = len(columns) if columns is not None else 0
+        key = (id(columns), self._statistics is not None, self._index is not None, self._search is not None)
+        if self._size[0] != key:
+            with self._lock:
+                parts = [columns, self._statistics, self._index, self._search]
+                self._size = (key, deep_size([part for part in parts if part is not None]), rows)
+        _, size, measured_rows = self._size
+        return size + (rows - measured_rows) * size // max(measured_rows, 1)
+
+    def unload(self):
+        """Drops everything loaded, it is loaded again on next access"""
+        with self._lock:
+            self._columns = self._statistics = self._index = self._search = None
+
+    def refresh(self):
+        """Picks up lines appended to the file since it was loaded, returns the number of new rows"""
+        if self._columns is None:
+            return 0
+        with self._lock, METRICS.span("eval_file.refresh"):
+            try:
+                first_row = self._columns.refresh()
+            except (OSError, ValueError):
+                # e.g. a line that can't be decoded, or the file was removed: load it again on next access,
+                # which recompiles the cache or reports the error
+                first_row = None
+            if first_row is None:
+                # the file was rewritten, load it again on next access
+                self._columns = self._statistics = self._index = self._search = None
+                return 0
+            new_rows = len(self._columns) - first_row
+            METRICS.count("rows_appended", new_rows)
+            if new_rows:
+                # only the new rows are counted and indexed
+                if self._statistics is not None:
+                    self._statistics.extend(self._columns, first_row)
+                if self._index is not None:
+                    self._index.extend(self._columns, first_row)
+                if self._search is not None:
+                    self._search.extend(self._columns, first_row)
+        return new_rows
+
+
+class DatasetCache:
+    """EvalFiles by name, shared by all sessions and kept within a memory budget
+
+    Holders (e.g. UI sessions) declare the files they are viewing with hold(). trim() unloads the least
+    recently used files that nobody holds until the loaded files fit the budget; an unloaded file is loaded
+    again transparently (from its columnar cache) on its next access.
+    """
+
+    def __init__(self, directory=DATA_DIR, budget=MEMORY_BUDGET, cache_dir=CACHE_DIR, holder_ttl=HOLDER_TTL):
+        self.directory = directory
+        self.budget = budget
+        self.cache_dir = cache_dir
+        self.holder_ttl = holder_ttl
+        # least recently used first
+        self._files = OrderedDict()
+        # name -> {holder: time it was last seen}
+        self._holders = {}
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            eval_file = self._files.get(name)
+            if eval_file is None:
+                eval_file = self._files[name] = EvalFile(os.path.join(self.directory, name), self.cache_dir)
+            self._files.move_to_end(name)
+        return eval_file
+
+    def __contains__(self, name):
+        return name in self._files
+
+    def hold(self, holder, names):
+        """The files holder is viewing now, replacing the ones it held before"""
+        now = time.monotonic()
+        with self._lock:
+            for name in list(self._holders):
+                if name not in names:
+                    self._holders[name].pop(holder, None)
+            for name in names:
+                self._holders.setdefault(name, {})[holder] = now
+
+    def release(self, holder):
+        self.hold(holder, [])
+
+    def refcount(self, name):
+        """Number of holders that viewed the file within holder_ttl seconds"""
+        now = time.monotonic()
+        with self._lock:
+            holders = self._holders.get(name, {})
+            for holder, seen in list(holders.items()):
+                if now - seen > self.holder_ttl:
+                    del holders[holder]
+            return len(holders)
+
+    def memory(self):
+        """Bytes held by every loaded file"""
+        with self._lock:
+            files = list(self._files.items())
+        return {name: eval_file.nbytes() for name, eval_file in files if eval_file.loaded()}
+
+    def trim(self):
+        """Unloads files nobody holds, least recently used first, until the loaded ones fit the budget"""
+        sizes = self.memory()
+        total = sum(sizes.values())
+        evicted = []
+        for name in list(sizes):
+            if total <= self.budget:
+                break
+            if self.refcount(name):
+                continue
+            self._files[name].unload()
+            total -= sizes[name]
+            evicted.append(name)
+        METRICS.count("datasets_evicted", len(evicted))
+        return evicted
@@ -0,0 +1,67 @@
+"""Index of the rows of an evaluation file by question, process and model"""
+
+
+class QuestionIndex:
+    """Maps question ordinals (order of first appearance) to the row ids of every process and model"""
+
+    def __init__(self, columns=None):
+        self.questions = []
+        # question string code -> ordinal
+        self._ordinals = {}
+        # per ordinal: {(process, model): [row ids]}
+        self._rows = []
+        self.row_count = 0
+        if columns is not None:
+            self.extend(columns)
+
+    def extend(self, columns, start=0):
+        """Adds the rows of columns from row start on"""
+        questions = columns.strings["question"]
+        processes = columns.strings["process"]
+        models = columns.strings["model"]
+        codes = zip(columns["question"][start:].tolist(), columns["process"][start:].tolist(),
+                    columns["model"][start:].tolist())
+        for row, (question, process, model) in enumerate(codes, start):
+            ordinal = self._ordinals.get(question)
+            if ordinal is None:
+                ordinal = self._ordinals[question] = len(self.questions)
+                self.questions.append(questions[question])
+                self._rows.append({})
+            self._rows[ordinal].setdefault((processes[process], models[model]), []).append(row)
+        self.row_count = max(self.row_count, len(columns))
+
+    def __len__(self):
+        return len(self.questions)
+
+    def page(self, first, count):
+        """(ordinal, question) pairs of the questions first to first + count - 1"""
+        first = max(0, first)
+        return list(enumerate(self.questions[first:first + count], first))
+
+    def matching(self, columns, rows):
+        """(ordinal, question) pairs of the questions of some rows, in order of first appearance"""
+        codes = set(columns["question"][rows].tolist())
+        return [(ordinal, self.questions[ordinal]) for ordinal in sorted(self._ordinals[code] for code in codes)]
+
+    def rows(self, ordinal, process, model):
+        """Row ids of one question, process and model"""
+        return self._rows[ordinal].get((process, model), [])
+
+    def processes(self, ordinal):
+        return {process for process, _ in self._rows[ordinal]}
+
+    def question_records(self, ordinal, columns, models, matches=None):
+        """{process: {model: [records]}} of one question, decoding only the records of this question
+
+        With matches (a set of row ids), only the matching rows are decoded.
+        """
+        records = {}
+        for (process, model), rows in self._rows[ordinal].items():
+            if matches is not None:
+                rows = [row for row in rows if row in matches]
+                if not rows:
+                    continue
+            if process not in records:
+                records[process] = {model_original: [] for model_original in models}
+            records[process][model] = [columns.record(row) for row in rows]
+        return records
@@ -0,0 +1,142 @@
+"""Opt-in instrumentation of the evaluator: span timings, counters and cache hit rates
+
+METRICS is shared by the whole process (all sessions of the UI). It records nothing until it is enabled,
+a disabled span costs one attribute check. The collected values can be shown in the UI, appended to a JSON
+log or served in the Prometheus text format.
+"""
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class Metrics:
+    """Thread-safe span timings and counters, plus the hit/miss counts of registered caches"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        # name -> {"count", "total", "max", "last"} in seconds
+        self.spans = {}
+        self.counters = {}
+        # name -> [hits, misses] counted with hit(), or a function returning (hits, misses)
+        self._hits = {}
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        with self._lock:
+            span = self.spans.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0, "last": 0.0})
+            span["count"] += 1
+            span["total"] += seconds
+            span["max"] = max(span["max"], seconds)
+            span["last"] = seconds
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def hit(self, cache, hit):
+        """Counts one lookup of a cache"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._hits.setdefault(cache, [0, 0])[0 if hit else 1] += 1
+
+    def register_cache(self, name, stats):
+        """stats returns (hits, misses), e.g. lambda: (f.cache_info().hits, f.cache_info().misses)"""
+        self._caches[name] = stats
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.spans = {}
+            self.counters = {}
+            self._hits = {}
+
+    def snapshot(self):
+        """All values as a JSON-serializable dict"""
+        with self._lock:
+            spans = {name: dict(span) for name, span in self.spans.items()}
+            counters = dict(self.counters)
+            lookups = {name: tuple(counts) for name, counts in self._hits.items()}
+        # registered caches count since the start of the process, not since reset()
+        lookups.update((name, stats()) for name, stats in self._caches.items())
+        caches = {}
+        for name, (hits, misses) in lookups.items():
+            caches[name] = {"hits": hits, "misses": misses,
+                            "hit_rate": hits / (hits + misses) if hits + misses else None}
+        return {"time": time.time(), "since": self.started, "spans": spans, "counters": counters,
+                "caches": caches}
+
+    def prometheus(self):
+        """The values in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [
+            "# TYPE evaluator_span_seconds summary",
+        ]
+        for name, span in sorted(snapshot["spans"].items()):
+            label = _label(name)
+            lines.append(f'evaluator_span_seconds_count{{span="{label}"}} {span["count"]}')
+            lines.append(f'evaluator_span_seconds_sum{{span="{label}"}} {span["total"]:.6f}')
+        lines.append("# TYPE evaluator_span_max_seconds gauge")
+        for name, span in sorted(snapshot["spans"].items()):
+            lines.append(f'evaluator_span_max_seconds{{span="{_label(name)}"}} {span["max"]:.6f}')
+        lines.append("# TYPE evaluator_events_total counter")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f'evaluator_events_total{{event="{_label(name)}"}} {value}')
+        lines.append("# TYPE evaluator_cache_requests_total counter")
+        for name, cache in sorted(snapshot["caches"].items()):
+            lines.append(f'evaluator_cache_requests_total{{cache="{_label(name)}",result="hit"}} {cache["hits"]}')
+            lines.append(f'evaluator_cache_requests_total{{cache="{_label(name)}",result="miss"}} {cache["misses"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_log(self, path):
+        """Appends the current values as one JSON line"""
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(self.snapshot()) + "\n")
+
+
+def _label(value):
+    return re.sub(r'["\\\n]', "_", str(value))
+
+
+METRICS = Metrics()
+
+
+def serve_prometheus(port, metrics=METRICS, host="127.0.0.1"):
+    """Serves GET /metrics in a daemon thread, returns the server"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
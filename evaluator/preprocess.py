@@ -0,0 +1,95 @@
+"""Derived fields and outcome classification of evaluation records"""
+import json
+
+from evaluator.sparql import analyze
+
+ICON_NOT_VALID = "🚫"
+ICON_ERROR = "❌"
+ICON_CORRECT = "✅"
+ICON_INCORRECT = "⚠️"
+ICON_UNKNOWN = "❓"
+ICON_SPARQL_QUERY_INCORRECT = "🛑"
+ICON_MASK = '👺'
+
+
+def get_prepared_results(data):
+    global ICON_NOT_VALID
+    global ICON_ERROR
+    global ICON_CORRECT
+    global ICON_INCORRECT
+    global ICON_UNKNOWN
+    # global ICON_MASK
+
+    valid_query = data.get("valid_query")
+    error = data.get("error")
+    correct = data.get("correct")
+    # mask_broken = data.get('wikidata_uri_in_masked')
+
+    if valid_query != True:
+        icon = ICON_NOT_VALID
+        message = "Invalid response(the query was NOT successfully extracted from LLM response or has NOT passed RDFlib syntax check 'error' contains reason to fail). Error: {error}"
+    elif error != None:
+        icon = ICON_ERROR
+        message = "Error response: should not be here if valid_query is None"
+    elif correct == True:
+        icon = ICON_CORRECT
+        message = "Correct response: query returns non-empty list, and set of returned URIs is equal to set of URIs from the gold standard"
+    else:
+        icon = ICON_INCORRECT
+        message = "Incorrect response: query returns empty list, or set of returned URIs is not equal to set of URIs from the gold standard"
+
+    return icon, message
+
+
+def check_sparql_query(normal_query):
+    words = analyze(normal_query).words if normal_query != None else {}
+    if words.get("SELECT") or words.get("ASK"):
+        return True
+    return False
+
+
+def preprocess(record):
+    """Adds additional fields to the record based on the input and the model response"""
+    if not isinstance(record, dict):
+        return
+    
+    if 'error_extra' not in record:
+        record['error_extra'] = []
+
+    record['multiple_clause'] = False
+    record['wikidata_uri_in_masked'] = False
+
+    try:
+        response = record.get("response")
+        response = json.loads(response)
+        # the query lines are joined with line breaks, so a comment ends with its line
+        analysis = analyze('\n'.join(response.get("query", [])))
+
+        if analysis.words["SELECT"] > 1:
+            record['error_extra'].append('Multiple SELECT keywords')
+            record['multiple_clause'] = True
+        if analysis.words["ASK"] > 1:
+            record['error_extra'].append('Multiple ASK keywords')
+            record['multiple_clause'] = True
+        
+        if record.get('process', None) == 'masked':
+            if analysis.prefixes["wd"] or analysis.prefixes["wdt"]:
+                record['error_extra'].append('Wikidata URIs present in the masked process output')
+                record['wikidata_uri_in_masked'] = True
+
+        if True in record.get('gold', []) or False in record.get('gold', []):
+            record['expected_type'] = 'ASK'
+        elif record.get('gold') is None:
+            record['expected_type'] = None
+        else:
+            record['expected_type'] = 'SELECT'
+
+        if analysis.words["ASK"]:
+            record['predicted_type'] = 'ASK'
+        elif analysis.words["SELECT"]:
+            record['predicted_type'] = 'SELECT'
+        else:
+            record['predicted_type'] = None
+
+    except Exception as e:
+        record['error_extra'].append(f'Exception in function preprocess: {e}')
@@ -0,0 +1,149 @@
+"""Headless reports of evaluation files as JSON, CSV or Markdown
+
+Computes the statistics of the evaluator UI for many files in parallel, without Streamlit. A report can be
+checked against an earlier one (--baseline), the exit code is 1 if the accuracy of any model and process
+dropped by more than the tolerance, so CI can track regressions.
+
+python -m evaluator.report data/*-eval.jsonl --json report.json --csv report.csv --markdown report.md
+"""
+import csv
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from evaluator.columnar import CACHE_DIR, OUTCOMES
+from evaluator.dataset import DATA_DIR, EvalFile, list_eval_files
+from evaluator.preprocess import ICON_CORRECT
+from evaluator.statistics import prepare_stats
+
+# columns of the CSV and Markdown tables, one row per file, model and process
+CELL_FIELDS = ["file", "model", "process", "rows", "correct", "incorrect", "not_valid", "error", "accuracy",
+               "mean_f1", "wikidata_uri_in_masked", "sparql_query_incorrect"]
+OUTCOME_FIELDS = ["correct", "incorrect", "not_valid", "error"]
+
+
+def file_report(source, cache_dir=CACHE_DIR):
+    """Totals and per model × process statistics of one file"""
+    eval_file = EvalFile(source, cache_dir)
+    columns = eval_file.columns
+    if columns is None:
+        return {"file": Path(source).name, "error": eval_file.error}
+    statistics = eval_file.statistics
+    cells = []
+    for model in statistics.models:
+        for process in statistics.processes:
+            counts = statistics.outcome_counts(model, process)
+            rows = sum(counts.values())
+            if not rows:
+                continue
+            cell = {"file": Path(source).name, "model": model, "process": process, "rows": rows}
+            cell.update({field: counts[icon] for field, icon in zip(OUTCOME_FIELDS, OUTCOMES)})
+            cell["accuracy"] = counts[ICON_CORRECT] / rows
+            cell["mean_f1"] = statistics.mean_f1(model, process)
+            cell["wikidata_uri_in_masked"] = statistics.flag_count("wikidata_uri_in_masked", model, process)
+            cell["sparql_query_incorrect"] = statistics.flag_count("sparql_query_incorrect", model, process)
+            cells.append(cell)
+    return {"file": Path(source).name, "totals": prepare_stats(columns), "cells": cells}
+
+
+def build_reports(sources, cache_dir=CACHE_DIR, max_workers=None):
+    """Reports of all files, computed in parallel, in the order of sources"""
+    sources = list(sources)
+    if len(sources) <= 1:
+        return [file_report(source, cache_dir) for source in sources]
+    max_workers = min(max_workers or os.cpu_count() or 1, len(sources))
+    # spawn as in evaluator.warmup, reports are small dicts
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        return list(pool.map(file_report, sources, [cache_dir] * len(sources)))
+
+
+def _cells(reports):
+    return [cell for report in reports for cell in report.get("cells", [])]
+
+
+def write_json(reports, path):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(reports, file, ensure_ascii=False, indent=2)
+
+
+def write_csv(reports, path):
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=CELL_FIELDS)
+        writer.writeheader()
+        writer.writerows(_cells(reports))
+
+
+def _format(value):
+    if isinstance(value, float):
+        return f"{value:.1%}"
+    return "" if value is None else str(value)
+
+
+def write_markdown(reports, path):
+    lines = ["# Evaluation report", ""]
+    for report in reports:
+        lines.append(f"## {report['file']}")
+        lines.append("")
+        if "error" in report:
+            lines += [report["error"], ""]
+            continue
+        totals = report["totals"]
+        lines.append(f"{totals['total']} rows, {totals['correct']} correct, {totals['valid']} valid queries")
+        lines.append("")
+        fields = CELL_FIELDS[1:]
+        lines.append("| " + " | ".join(fields) + " |")
+        lines.append("|" + "---|" * len(fields))
+        for cell in report["cells"]:
+            lines.append("| " + " | ".join(_format(cell[field]) for field in fields) + " |")
+        lines.append("")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\n".join(lines))
+
+
+def regressions(reports, baseline, tolerance=0.0):
+    """Cells whose accuracy dropped by more than tolerance against a baseline report"""
+    before = {(cell["file"], cell["model"], cell["process"]): cell["accuracy"] for cell in _cells(baseline)}
+    dropped = []
+    for cell in _cells(reports):
+        key = (cell["file"], cell["model"], cell["process"])
+        if key in before and cell["accuracy"] < before[key] - tolerance:
+            dropped.append({**cell, "baseline_accuracy": before[key]})
+    return dropped
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Statistics of evaluation files as JSON, CSV or Markdown")
+    parser.add_argument("sources", nargs="*", help=f"evaluation files, default: all *-eval.jsonl in {DATA_DIR}/")
+    parser.add_argument("--json")
+    parser.add_argument("--csv")
+    parser.add_argument("--markdown")
+    parser.add_argument("--baseline", help="earlier JSON report, exit with 1 if the accuracy dropped")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="accepted accuracy drop (0.01 = 1 point)")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    sources = args.sources or [os.path.join(DATA_DIR, name) for name in list_eval_files()]
+    reports = build_reports(sources, max_workers=args.workers)
+    for writer, path in ((write_json, args.json), (write_csv, args.csv), (write_markdown, args.markdown)):
+        if path:
+            writer(reports, path)
+    for report in reports:
+        if "error" in report:
+            print(f"{report['file']}: {report['error']}")
+        else:
+            print(f"{report['file']}: {report['totals']['correct']}/{report['totals']['total']} correct")
+    if any("error" in report for report in reports):
+        sys.exit(1)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            dropped = regressions(reports, json.load(file), args.tolerance)
+        for cell in dropped:
+            print(f"regression: {cell['file']} {cell['model']} {cell['process']}: "
+                  f"{cell['baseline_accuracy']:.1%} -> {cell['accuracy']:.1%}")
+        sys.exit(1 if dropped else 0)
@@ -0,0 +1,356 @@
+"""Offline re-scoring of the generated queries against a local triple store
+
+The store is built from the benchmark: every gold query is instantiated with its gold answers, variables that
+are not part of the answer are bound to witness nodes (urn:witness:...). On this neighbourhood of the gold
+answers every gold query returns exactly its gold results, so the generated queries can be executed and
+scored again without Wikidata. Queries that only match outside of the neighbourhood (e.g. on labels) return
+no results here.
+
+Queries are normalized (comments and whitespace dropped, kg: masks replaced by the Wikidata URIs, label
+SERVICE blocks removed) and executed in a process pool with a timeout per query. Results are cached on disk
+keyed by the normalized query and the benchmark files, so re-scoring after a change only executes new
+queries.
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from rdflib import Graph, Literal, URIRef, Variable
+from rdflib.paths import AlternativePath, SequencePath
+from rdflib.plugins.sparql import prepareQuery
+from rdflib.plugins.sparql.parserutils import CompValue
+
+from evaluator.benchmark import BENCHMARK, MAPPING, load_benchmark_index
+from evaluator.columnar import file_hash
+from evaluator.scoring import answer_metrics, summarize
+from evaluator.sparql import analyze
+
+RESULT_CACHE = ".cache/rescore.sqlite"
+# seconds per query
+QUERY_TIMEOUT = 10
+# bump when the store or the result format changes, invalidates the result cache
+STORE_VERSION = 1
+
+PREFIXES = {
+    "wd": "http://www.wikidata.org/entity/",
+    "wdt": "http://www.wikidata.org/prop/direct/",
+    "wdtn": "http://www.wikidata.org/prop/direct-normalized/",
+    "p": "http://www.wikidata.org/prop/",
+    "ps": "http://www.wikidata.org/prop/statement/",
+    "psv": "http://www.wikidata.org/prop/statement/value/",
+    "psn": "http://www.wikidata.org/prop/statement/value-normalized/",
+    "pq": "http://www.wikidata.org/prop/qualifier/",
+    "wikibase": "http://wikiba.se/ontology#",
+    "bd": "http://www.bigdata.com/rdf#",
+    "schema": "http://schema.org/",
+    "rdf": "http://www.w3.org/1999/02/22-rdf-syntax-ns#",
+    "rdfs": "http://www.w3.org/2000/01/rdf-schema#",
+    "owl": "http://www.w3.org/2002/07/owl#",
+    "xsd": "http://www.w3.org/2001/XMLSchema#",
+    "skos": "http://www.w3.org/2004/02/skos/core#",
+    "foaf": "http://xmlns.com/foaf/0.1/",
+}
+
+WITNESS = "urn:witness:"
+
+
+def expand(name):
+    """URIRef of a prefixed name like wd:Q5, other values become literals"""
+    if isinstance(name, str) and ":" in name:
+        prefix, local = name.split(":", 1)
+        if prefix in PREFIXES:
+            return URIRef(PREFIXES[prefix] + local)
+    return Literal(name)
+
+
+def shorten(term):
+    """Prefixed name of a URI (the notation of the gold results), the Python value of a literal"""
+    if isinstance(term, URIRef):
+        for prefix, namespace in PREFIXES.items():
+            if term.startswith(namespace) and "/" not in term[len(namespace):]:
+                return f"{prefix}:{term[len(namespace):]}"
+        return str(term)
+    if isinstance(term, Literal):
+        return term.toPython() if isinstance(term.toPython(), (bool, int, float)) else str(term)
+    return str(term)
+
+
+def _bgp_triples(node):
+    """Triple patterns of all basic graph patterns of a query algebra"""
+    if isinstance(node, CompValue):
+        if node.name == "BGP":
+            yield from node["triples"]
+        for value in node.values():
+            yield from _bgp_triples(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _bgp_triples(value)
+
+
+def _ground_triples(subject, path, object, ground, witness):
+    """Ground triples for one pattern, property paths are instantiated with their first alternative"""
+    subject, object = ground(subject), ground(object)
+    if isinstance(path, AlternativePath):
+        yield from _ground_triples(subject, path.args[0], object, ground, witness)
+    elif isinstance(path, SequencePath):
+        nodes = [subject] + [witness(f"seq{i}") for i in range(len(path.args) - 1)] + [object]
+        for i, step in enumerate(path.args):
+            yield from _ground_triples(nodes[i], step, nodes[i + 1], ground, witness)
+    elif isinstance(path, URIRef):
+        yield subject, path, object
+
+
+def build_graph(entries):
+    """Local store: the gold queries instantiated with their gold answers"""
+    graph = Graph()
+    for entry in entries:
+        query = prepareQuery(entry["sparql"], initNs=PREFIXES)
+        projection = query.algebra.get("PV") or []
+        if query.algebra.name == "AskQuery":
+            bindings = [{}] if entry["results"] == [True] else []
+        else:
+            bindings = [dict(zip(projection, map(expand, row))) for row in entry["results"]]
+        for i, binding in enumerate(bindings):
+            def witness(name):
+                return URIRef(f"{WITNESS}{entry['id']}/{i}/{name}")
+
+            def ground(term):
+                if isinstance(term, Variable):
+                    return binding.get(term) or witness(term)
+                return term
+
+            for subject, path, object in _bgp_triples(query.algebra):
+                for triple in _ground_triples(subject, path, object, ground, witness):
+                    graph.add(triple)
+    return graph
+
+
+def normalize_query(query, masks=None):
+    """Query without comments, redundant whitespace and SERVICE blocks, kg: masks replaced by their URIs"""
+    masks = {mask["mask"]: mask["uri"] for mask in masks or []}
+    parts = []
+    # depth of the braces of the SERVICE block being skipped, None outside of SERVICE blocks
+    skipping = None
+    depth = 0
+    for kind, text in analyze(query).tokens:
+        if kind == "word" and text.upper() == "SERVICE" and skipping is None:
+            skipping = depth
+            continue
+        if text == "{":
+            depth += 1
+        elif text == "}":
+            depth -= 1
+            if skipping is not None and depth == skipping:
+                skipping = None
+                continue
+        if skipping is not None:
+            continue
+        if kind in ("space", "comment"):
+            # adjacent tokens (!=, @en, 1.5) stay adjacent, any whitespace becomes one space
+            if parts and parts[-1] != " ":
+                parts.append(" ")
+        else:
+            parts.append(masks.get(text, text) if kind == "pname" else text)
+    return "".join(parts).strip()
+
+
+class ResultCache:
+    """SQLite cache of query results, keyed by a hash of the store and the normalized query"""
+
+    def __init__(self, path, store_key):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.store_key = store_key
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+        self._connection.commit()
+
+    def key(self, query):
+        return hashlib.sha256(f"{self.store_key}\n{query}".encode("utf-8")).hexdigest()
+
+    def get(self, query):
+        row = self._connection.execute("SELECT result FROM results WHERE key = ?", (self.key(query),)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put_many(self, results):
+        self._connection.executemany("INSERT OR REPLACE INTO results (key, result) VALUES (?, ?)",
+                                     [(self.key(query), json.dumps(result)) for query, result in results.items()])
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+
+# the store of a worker process, built once by _init_worker
+_graph = None
+_timeout = QUERY_TIMEOUT
+
+
+def _raise_timeout(signum, frame):
+    raise TimeoutError()
+
+
+def _init_worker(timeout):
+    global _graph, _timeout
+    _graph = build_graph(load_benchmark_index().entries)
+    _timeout = timeout
+    if hasattr(signal, "SIGALRM"):
+        signal.signal(signal.SIGALRM, _raise_timeout)
+
+
+def execute(query, graph=None, timeout=None):
+    """{"valid": ..., "error": ..., "result": ...} of one normalized query on the local store"""
+    graph = _graph if graph is None else graph
+    timeout = _timeout if timeout is None else timeout
+    # undeclared prefixes (hallucinated or left-over kg: masks) are syntactically fine, they match nothing
+    namespaces = {prefix: f"urn:prefix:{prefix}:" for prefix in analyze(query).prefixes}
+    namespaces.update(PREFIXES)
+    try:
+        prepared = prepareQuery(query, initNs=namespaces)
+    except Exception as e:
+        return {"valid": False, "error": f"Invalid query: {e}", "result": None}
+    if prepared.algebra.get("datasetClause") or analyze(query).words["SERVICE"]:
+        # would load remote data
+        return {"valid": True, "error": "FROM and SERVICE are not supported offline", "result": None}
+    # SIGALRM only exists on Unix, there the timeout interrupts the evaluation
+    alarm = timeout and hasattr(signal, "SIGALRM")
+    try:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        result = graph.query(prepared)
+        if result.type == "ASK":
+            rows = [bool(result.askAnswer)]
+        else:
+            # witness nodes are placeholders of the store, not answers
+            rows = [[shorten(value) for value in row if value is not None and not value.startswith(WITNESS)]
+                    for row in result]
+            rows = [row for row in rows if row]
+    except TimeoutError:
+        return {"valid": True, "error": "Timeout", "result": None}
+    except Exception as e:
+        return {"valid": True, "error": f"Execution failed: {e}", "result": None}
+    finally:
+        if alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    return {"valid": True, "error": None, "result": rows}
+
+
+def execute_all(queries, timeout=QUERY_TIMEOUT, max_workers=None):
+    """{query: result} of all queries, executed in parallel"""
+    queries = list(queries)
+    if not queries:
+        return {}
+    max_workers = min(max_workers or os.cpu_count() or 1, len(queries))
+    # spawn as in evaluator.warmup: the caller may be a multi-threaded server
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context, initializer=_init_worker,
+                             initargs=(timeout,)) as pool:
+        chunksize = max(1, len(queries) // (4 * max_workers))
+        return dict(zip(queries, pool.map(execute, queries, chunksize=chunksize)))
+
+
+def rescored_path(source):
+    """data/mcwq-qwen_2.5-eval.jsonl -> data/mcwq-qwen_2.5-rescored-eval.jsonl"""
+    source = Path(source)
+    name = source.name[:-len("-eval.jsonl")] if source.name.endswith("-eval.jsonl") else source.stem
+    return source.with_name(f"{name}-rescored-eval.jsonl")
+
+
+def rescore_record(record, result, entry):
+    """Copy of a record with valid_query, error, predicted and gold from the local execution, correct is
+    set by rescore() for all records of a file at once
+    """
+    record = dict(record)
+    record.pop("predicted", None)
+    record.pop("gold", None)
+    record["correct"] = None
+    if result is None:
+        record.update(valid_query=False, error="Invalid query")
+        return record
+    record["valid_query"] = result["valid"]
+    record["error"] = result["error"]
+    if result["valid"] and result["error"] is None:
+        record["predicted"] = result["result"]
+        if entry is not None:
+            record["gold"] = entry["results"]
+    return record
+
+
+def rescore(sources, cache_path=RESULT_CACHE, timeout=QUERY_TIMEOUT, max_workers=None):
+    """Re-scores the evaluation files, writes the *-rescored-eval.jsonl files and returns per file
+    {"target", "rows", "correct", "agree", "metrics"}, agree counting the rows whose correct value did not
+    change and metrics summarizing exact match, precision, recall and F1
+    """
+    index = load_benchmark_index()
+    # the mapping file is optional, as in load_benchmark_index
+    store_key = json.dumps([STORE_VERSION, file_hash(BENCHMARK),
+                            file_hash(MAPPING) if os.path.exists(MAPPING) else None])
+    files = {}
+    for source in sources:
+        with open(source, "r", encoding="utf-8") as file:
+            records = [json.loads(line) for line in file if line.strip()]
+        normalized = []
+        for record in records:
+            entry = index.entry(record.get("question"))
+            query = record.get("normal_query")
+            normalized.append(None if query is None else normalize_query(query, entry and entry.get("masks")))
+        files[source] = records, normalized
+
+    cache = ResultCache(cache_path, store_key)
+    try:
+        results = {}
+        for _, normalized in files.values():
+            for query in normalized:
+                if query is not None and query not in results:
+                    results[query] = cache.get(query)
+        missing = [query for query, result in results.items() if result is None]
+        executed = execute_all(missing, timeout, max_workers)
+        cache.put_many(executed)
+        results.update(executed)
+    finally:
+        cache.close()
+
+    summary = {}
+    for source, (records, normalized) in files.items():
+        target = rescored_path(source)
+        rescored = [rescore_record(record, results.get(query), index.entry(record.get("question")))
+                    for record, query in zip(records, normalized)]
+        metrics = answer_metrics([record.get("predicted") for record in rescored],
+                                 [record.get("gold") for record in rescored])
+        for record, scored, exact in zip(rescored, metrics["scored"], metrics["exact"]):
+            if scored:
+                record["correct"] = bool(exact)
+        with open(target.with_suffix(".tmp"), "w", encoding="utf-8") as file:
+            for record in rescored:
+                file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(target.with_suffix(".tmp"), target)
+        summary[source] = {
+            "target": str(target),
+            "rows": len(rescored),
+            "correct": sum(record["correct"] is True for record in rescored),
+            "agree": sum(old.get("correct") == new["correct"] for old, new in zip(records, rescored)),
+            "metrics": summarize(metrics),
+        }
+    return summary
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # python -m evaluator.rescore data/*-eval.jsonl
+    parser = argparse.ArgumentParser(description="Re-score evaluation files against a local triple store")
+    parser.add_argument("sources", nargs="+")
+    parser.add_argument("--timeout", type=float, default=QUERY_TIMEOUT, help="seconds per query")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    sources = [source for source in args.sources if not Path(source).name.endswith("-rescored-eval.jsonl")]
+    for source, result in rescore(sources, timeout=args.timeout, max_workers=args.workers).items():
+        metrics = result["metrics"]
+        f1 = f", mean F1 {metrics['f1']:.3f}" if metrics["f1"] is not None else ""
+        print(f"{source} -> {result['target']}: {result['correct']}/{result['rows']} correct, "
+              f"{result['agree']} unchanged{f1}")
@@ -0,0 +1,101 @@
+"""Set-based comparison of predicted and gold answers
+
+Answers (URIs, literals and ASK booleans) are interned into integer ids. The answers of all rows of a file
+are stored as one array of ids, sorted and unique per row, plus row offsets. Exact match, precision, recall
+and F1 of a whole file then come from a few vectorized operations instead of a Python set comparison per row.
+"""
+import numpy as np
+
+
+class AnswerTable:
+    """Interns answer values into consecutive integer ids (True and 1 are kept apart)"""
+
+    def __init__(self):
+        self.ids = {}
+
+    def id(self, value):
+        key = (type(value), value)
+        answer_id = self.ids.get(key)
+        if answer_id is None:
+            answer_id = self.ids[key] = len(self.ids)
+        return answer_id
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def answer_values(results):
+    """Answer values of a result list: the values of all rows of a SELECT, the boolean of an ASK"""
+    return [value for row in results for value in (row if isinstance(row, list) else [row])]
+
+
+def answer_arrays(answers, table):
+    """Ids (sorted and unique per row), row offsets and presence of the answers of every row
+
+    answers holds one result list per row, None where the row has no answers.
+    """
+    ids = []
+    offsets = [0]
+    present = []
+    for results in answers:
+        if results is not None:
+            ids.extend(sorted({table.id(value) for value in answer_values(results)}))
+        offsets.append(len(ids))
+        present.append(results is not None)
+    return np.asarray(ids, dtype=np.int64), np.asarray(offsets, dtype=np.int64), np.asarray(present, dtype=bool)
+
+
+def is_ask(results):
+    return isinstance(results, list) and len(results) == 1 and isinstance(results[0], bool)
+
+
+def answer_metrics(predicted, gold):
+    """Per row metrics of predicted against gold answers, as a dict of arrays
+
+    scored: both answers are present; exact: the predicted answers are non-empty and equal the gold set (the
+    definition of correct); precision, recall, f1: partial credit, NaN where the row is not scored and 0 for
+    an empty side; ask: the gold answer is an ASK boolean.
+    """
+    table = AnswerTable()
+    predicted_ids, predicted_offsets, predicted_present = answer_arrays(predicted, table)
+    gold_ids, gold_offsets, gold_present = answer_arrays(gold, table)
+    rows = len(predicted_present)
+    predicted_size = np.diff(predicted_offsets)
+    gold_size = np.diff(gold_offsets)
+
+    # (row, answer) pairs as one integer, the intersection of all rows at once
+    width = len(table) + 1
+    predicted_keys = np.repeat(np.arange(rows, dtype=np.int64), predicted_size) * width + predicted_ids
+    gold_keys = np.repeat(np.arange(rows, dtype=np.int64), gold_size) * width + gold_ids
+    common = np.intersect1d(predicted_keys, gold_keys, assume_unique=True)
+    intersection = np.bincount(common // width, minlength=rows)
+
+    scored = predicted_present & gold_present
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted_size > 0, intersection / predicted_size, 0.0)
+        recall = np.where(gold_size > 0, intersection / gold_size, 0.0)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    return {
+        "scored": scored,
+        "exact": scored & (predicted_size > 0) & (intersection == predicted_size) & (intersection == gold_size),
+        "precision": np.where(scored, precision, np.nan),
+        "recall": np.where(scored, recall, np.nan),
+        "f1": np.where(scored, f1, np.nan),
+        "ask": np.asarray([is_ask(results) for results in gold], dtype=bool),
+    }
+
+
+def summarize(metrics, mask=None):
+    """Totals and means of the scored rows (optionally only those selected by mask)"""
+    scored = metrics["scored"] if mask is None else metrics["scored"] & mask
+    ask = scored & metrics["ask"]
+    count = int(scored.sum())
+    return {
+        "scored": count,
+        "exact": int((metrics["exact"] & scored).sum()),
+        "precision": float(np.mean(metrics["precision"][scored])) if count else None,
+        "recall": float(np.mean(metrics["recall"][scored])) if count else None,
+        "f1": float(np.mean(metrics["f1"][scored])) if count else None,
+        "ask": int(ask.sum()),
+        "ask_agreement": int((metrics["exact"] & ask).sum()),
+    }
@@ -0,0 +1,135 @@
+"""Faceted filtering and question text search over the rows of an evaluation file
+
+RecordIndex keeps a posting list (sorted row ids) per facet value and per question token. Filters are unions
+of postings within a facet and intersections across facets, so a query costs time in the number of matching
+rows, not in the size of the file.
+"""
+import re
+from bisect import bisect_left, insort
+
+import numpy as np
+
+from evaluator.columnar import OUTCOMES, QUERY_TYPES
+
+# facet -> column, and the value of each code of the column (None: the string table of the column)
+CODE_FACETS = {
+    "model": None,
+    "process": None,
+    "outcome": OUTCOMES,
+    "expected_type": QUERY_TYPES,
+    "predicted_type": QUERY_TYPES,
+}
+FLAG_FACETS = ["wikidata_uri_in_masked", "sparql_query_incorrect", "multiple_clause", "has_error"]
+TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return TOKEN.findall(text.lower())
+
+
+def _postings(codes):
+    """(code, sorted positions) of every code present in codes"""
+    order = np.argsort(codes, kind="stable")
+    present, starts = np.unique(codes[order], return_index=True)
+    return zip(present.tolist(), np.split(order, starts[1:]))
+
+
+def _add(postings, key, rows):
+    # row ids only grow, appending keeps a posting list sorted
+    if len(rows):
+        old = postings.get(key)
+        postings[key] = rows if old is None else np.concatenate([old, rows])
+
+
+def _union(postings):
+    postings = [rows for rows in postings if len(rows)]
+    if not postings:
+        return np.zeros(0, dtype=np.int64)
+    return np.asarray(postings[0]) if len(postings) == 1 else np.unique(np.concatenate(postings))
+
+
+class RecordIndex:
+    """Inverted index of the rows of an evaluation file by facet value and question token"""
+
+    def __init__(self, columns=None):
+        self.row_count = 0
+        self.postings = {facet: {} for facet in list(CODE_FACETS) + FLAG_FACETS + ["error_extra"]}
+        # question code -> rows
+        self._question_rows = {}
+        # token -> question codes, and the sorted vocabulary, so the last token of a search also matches as a prefix
+        self._token_questions = {}
+        self.vocabulary = []
+        self._questions_seen = 0
+        if columns is not None:
+            self.extend(columns)
+
+    def extend(self, columns, start=0):
+        """Adds the rows of columns from row start on, costs time in the number of new rows only"""
+        for facet, values in CODE_FACETS.items():
+            values = values or columns.strings[facet]
+            for code, rows in _postings(np.asarray(columns[facet][start:], dtype=np.int64)):
+                _add(self.postings[facet], values[code], rows + start)
+        for facet in FLAG_FACETS:
+            _add(self.postings[facet], True, np.flatnonzero(columns[facet][start:]) + start)
+        # error_extra tags: one entry per (row, tag), rows repeat as often as they have tags
+        offsets = columns["error_extra_offsets"][start:]
+        tags = np.asarray(columns["error_extra"][offsets[0]:offsets[-1]], dtype=np.int64)
+        rows = np.repeat(np.arange(start, len(columns)), np.diff(offsets))
+        for code, entries in _postings(tags):
+            _add(self.postings["error_extra"], columns.strings["error_extra"][code], np.unique(rows[entries]))
+
+        # question tokens -> question codes -> rows
+        for code, rows in _postings(np.asarray(columns["question"][start:], dtype=np.int64)):
+            _add(self._question_rows, code, rows + start)
+        questions = columns.strings["question"]
+        for code in range(self._questions_seen, len(questions)):
+            for token in set(tokenize(questions[code])):
+                if token not in self._token_questions:
+                    self._token_questions[token] = []
+                    insort(self.vocabulary, token)
+                self._token_questions[token].append(code)
+        self._questions_seen = len(questions)
+        self.row_count = len(columns)
+
+    def values(self, facet):
+        """(value, number of rows) of a facet, most frequent first"""
+        return sorted(((value, len(rows)) for value, rows in self.postings[facet].items()),
+                      key=lambda item: -item[1])
+
+    def _questions(self, token, prefix=False):
+        start = bisect_left(self.vocabulary, token)
+        end = start
+        while end < len(self.vocabulary) and (self.vocabulary[end] == token or
+                                                prefix and self.vocabulary[end].startswith(token)):
+            end += 1
+        return _union([self._token_questions[token] for token in self.vocabulary[start:end]])
+
+    def search(self, text):
+        """Rows whose question contains every word of text, the last word may be incomplete"""
+        tokens = tokenize(text)
+        if not tokens:
+            return None
+        questions = None
+        for i, token in enumerate(tokens):
+            matches = self._questions(token, prefix=i == len(tokens) - 1)
+            questions = matches if questions is None else np.intersect1d(questions, matches, assume_unique=True)
+        return _union([self._question_rows[code] for code in questions.tolist()])
+
+    def select(self, filters=None, text=""):
+        """Sorted row ids matching all filters ({facet: [values]}, any of the values) and the text search
+
+        Returns None if nothing is filtered.
+        """
+        selected = [_union([self.postings[facet].get(value, []) for value in values])
+                    for facet, values in (filters or {}).items() if values]
+        rows = self.search(text)
+        if rows is not None:
+            selected.append(rows)
+        if not selected:
+            return None
+        # smallest posting list first, every intersection can only shrink it
+        selected.sort(key=len)
+        rows = selected[0]
+        for other in selected[1:]:
+            rows = np.intersect1d(rows, other, assume_unique=True)
+        return rows
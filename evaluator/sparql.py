@@ -0,0 +1,65 @@
+"""Single-pass lexical analysis of SPARQL queries
+
+analyze() tokenizes a query once and collects everything the evaluator needs from it: the query form, the
+number of every keyword, the prefixes of the prefixed names and the tokens for pretty-printing. Strings,
+IRIs and comments are separate tokens, so keywords inside them are not counted. Results are cached on the
+query text, so preprocessing, the checks and the detail view of a record share one analysis.
+"""
+import re
+from collections import Counter, namedtuple
+from functools import lru_cache
+
+# query forms, in the order of the SPARQL grammar
+QUERY_FORMS = ["SELECT", "CONSTRUCT", "DESCRIBE", "ASK"]
+
+# keywords that start a new line in the pretty-printed layout
+CLAUSE_KEYWORDS = {"SELECT", "WHERE", "FILTER", "OPTIONAL", "UNION", "LIMIT", "ORDER"}
+
+TOKEN = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>\#[^\n]*)
+  | (?P<string>'''(?:[^'\\]|\\.|'(?!''))*'''|\"\"\"(?:[^"\\]|\\.|"(?!""))*\"\"\"
+      |'(?:[^'\\\n]|\\.)*'|"(?:[^"\\\n]|\\.)*")
+  | (?P<iri><[^<>"{}|^`\\\x00-\x20]*>)
+  | (?P<variable>[?$]\w+)
+  | (?P<pname>(?:[A-Za-z][\w.-]*)?:(?:[\w%:-]|\.(?=[\w%:-]))*)
+  | (?P<word>\w+)
+  | (?P<symbol>.)
+""", re.VERBOSE | re.DOTALL)
+
+Analysis = namedtuple("Analysis", ["form", "words", "prefixes", "tokens"])
+
+
+@lru_cache(maxsize=8192)
+def analyze(query):
+    """Analysis of a query: form (first query form keyword or None), words (Counter of the upper-cased bare
+    words, i.e. keywords and numbers), prefixes (Counter of the prefixes of prefixed names) and tokens
+    ((kind, text) pairs). The result is shared by all callers and must not be modified.
+    """
+    form = None
+    words = Counter()
+    prefixes = Counter()
+    tokens = []
+    for match in TOKEN.finditer(query or ""):
+        kind, text = match.lastgroup, match.group()
+        if kind == "word":
+            word = text.upper()
+            words[word] += 1
+            if form is None and word in QUERY_FORMS:
+                form = word
+        elif kind == "pname":
+            prefixes[text.split(":", 1)[0]] += 1
+        tokens.append((kind, text))
+    return Analysis(form, words, prefixes, tuple(tokens))
+
+
+def pretty_print(query):
+    """Query with a line break before every clause keyword (SELECT, WHERE, FILTER, ...)"""
+    if query is None:
+        return None
+    lines = []
+    for kind, text in analyze(query).tokens:
+        if kind == "word" and text.upper() in CLAUSE_KEYWORDS:
+            lines.append("\n")
+        lines.append(text)
+    return "".join(lines)
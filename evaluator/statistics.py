@@ -0,0 +1,129 @@
+"""Statistics of evaluation files, computed on the columnar data with vectorized group-bys"""
+import numpy as np
+
+from evaluator.columnar import OUTCOMES, QUERY_TYPES
+from evaluator.preprocess import ICON_NOT_VALID
+
+
+def group_counts(columns, weights=None, start=0):
+    """Counts (or sums of weights) of rows per model × process, as an array of shape (models, processes)
+
+    Only rows from start on are counted, weights holds one value per counted row.
+    """
+    shape = (len(columns.strings["model"]), len(columns.strings["process"]))
+    cell = np.asarray(columns["model"][start:], dtype=np.int64) * shape[1] + columns["process"][start:]
+    if weights is not None:
+        weights = np.asarray(weights, dtype=np.int64)
+    counts = np.bincount(cell, weights=weights, minlength=shape[0] * shape[1])
+    return counts.astype(np.int64).reshape(shape)
+
+
+def group_sums(columns, values, start=0):
+    """Sums of float values per model × process, NaN values are skipped; values holds one value per row from
+    start on
+    """
+    shape = (len(columns.strings["model"]), len(columns.strings["process"]))
+    cell = np.asarray(columns["model"][start:], dtype=np.int64) * shape[1] + columns["process"][start:]
+    values = np.asarray(values, dtype=np.float64)
+    return np.bincount(cell, weights=np.nan_to_num(values), minlength=shape[0] * shape[1]).reshape(shape)
+
+
+def contingency_table(columns, start=0):
+    """Number of rows per model × process × outcome, as an array of shape (models, processes, outcomes)
+
+    Only rows from start on are counted.
+    """
+    shape = (len(columns.strings["model"]), len(columns.strings["process"]), len(OUTCOMES))
+    cell = (np.asarray(columns["model"][start:], dtype=np.int64) * shape[1] + columns["process"][start:]) \
+        * shape[2] + columns["outcome"][start:]
+    return np.bincount(cell, minlength=shape[0] * shape[1] * shape[2]).reshape(shape)
+
+
+def _grow(array, shape):
+    """Pads array with zeros to shape (new models or processes showed up)"""
+    if array.shape == shape:
+        return array
+    return np.pad(array, [(0, new - old) for old, new in zip(array.shape, shape)])
+
+
+class Statistics:
+    """Per model and process counts of outcomes and flags of one evaluation file"""
+
+    def __init__(self, columns):
+        self.models = []
+        self.processes = []
+        self.outcomes = np.zeros((0, 0, len(OUTCOMES)), dtype=np.int64)
+        self.wikidata_uri_in_masked = np.zeros((0, 0), dtype=np.int64)
+        self.sparql_query_incorrect = np.zeros((0, 0), dtype=np.int64)
+        # rows with predicted and gold answers and the sum of their F1 scores
+        self.scored = np.zeros((0, 0), dtype=np.int64)
+        self.f1_sums = np.zeros((0, 0), dtype=np.float64)
+        self.extend(columns)
+
+    def extend(self, columns, start=0):
+        """Adds the counts of the rows of columns from row start on"""
+        self.models = list(columns.strings["model"])
+        self.processes = list(columns.strings["process"])
+        shape = (len(self.models), len(self.processes))
+        self.outcomes = _grow(self.outcomes, shape + (len(OUTCOMES),)) + contingency_table(columns, start)
+        self.wikidata_uri_in_masked = _grow(self.wikidata_uri_in_masked, shape) \
+            + group_counts(columns, columns["wikidata_uri_in_masked"][start:], start)
+        # invalid responses whose normal_query contains neither SELECT nor ASK
+        not_valid = columns["outcome"][start:] == OUTCOMES.index(ICON_NOT_VALID)
+        self.sparql_query_incorrect = _grow(self.sparql_query_incorrect, shape) \
+            + group_counts(columns, not_valid & columns["sparql_query_incorrect"][start:], start)
+        f1 = columns["f1"][start:]
+        self.scored = _grow(self.scored, shape) + group_counts(columns, ~np.isnan(f1), start)
+        self.f1_sums = _grow(self.f1_sums, shape) + group_sums(columns, f1, start)
+
+    def _cell(self, model, process):
+        if model not in self.models or process not in self.processes:
+            return None
+        return self.models.index(model), self.processes.index(process)
+
+    def outcome_counts(self, model, process):
+        """{icon: count} for one model and process"""
+        cell = self._cell(model, process)
+        if cell is None:
+            return {icon: 0 for icon in OUTCOMES}
+        return {icon: int(count) for icon, count in zip(OUTCOMES, self.outcomes[cell])}
+
+    def flag_count(self, name, model, process):
+        cell = self._cell(model, process)
+        return 0 if cell is None else int(getattr(self, name)[cell])
+
+    def mean_f1(self, model, process):
+        """Mean F1 of the scored rows of one model and process, None if there are none"""
+        cell = self._cell(model, process)
+        if cell is None or not self.scored[cell]:
+            return None
+        return float(self.f1_sums[cell] / self.scored[cell])
+
+    def process_total(self, process):
+        """Number of rows of a process over all models"""
+        if process not in self.processes:
+            return 0
+        return int(self.outcomes[:, self.processes.index(process)].sum())
+
+
+def prepare_stats(columns):
+    """Prepares statistics for the data"""
+    valid = np.asarray(columns["valid_query"]) == 1
+    expected_type = np.asarray(columns["expected_type"])
+    stats = {
+        "total": len(columns),
+        "correct": int((np.asarray(columns["correct"]) == 1).sum()),
+        "incorrect": 0,
+        "error": int(np.count_nonzero(columns["has_error"])),
+        "valid": int(valid.sum()),
+        "invalid": int((~valid).sum()),
+        "unknown": int((np.asarray(columns["correct"]) == -1).sum()),
+        "sparql_query_incorrect": int(np.count_nonzero(columns["sparql_query_incorrect"])),
+        "multiple_clause": int(np.count_nonzero(columns["multiple_clause"])),
+        "wikidata_uri_in_masked": int(np.count_nonzero(columns["wikidata_uri_in_masked"])),
+        "wrong_type_predicted": int(((expected_type != QUERY_TYPES.index(None))
+                                     & (expected_type != columns["predicted_type"])).sum()),
+        "mean_f1": float(np.nanmean(columns["f1"])) if np.any(~np.isnan(columns["f1"])) else None,
+    }
+    stats["incorrect"] = stats["valid"] - stats["correct"]
+    return stats
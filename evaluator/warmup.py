@@ -0,0 +1,45 @@
+"""Parallel warm-up of the columnar caches of many evaluation files
+
+The files are parsed and preprocessed in a process pool. Workers only write the columnar cache of their file
+and return its path, no records are pickled back; loading a warmed file afterwards just memory-maps the
+arrays, so all processes share one copy of the data.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from evaluator.columnar import CACHE_DIR, read_meta, cache_path, cache_state, load_eval_file
+
+
+def _prepare(source, cache_dir):
+    load_eval_file(source, cache_dir)
+    return str(cache_path(source, cache_dir))
+
+
+def warm_up(sources, cache_dir=CACHE_DIR, max_workers=None):
+    """Compiles the caches of all files that need it in parallel, returns {source: cache path or exception}"""
+    sources = [source for source in sources
+               if cache_state(source, read_meta(cache_path(source, cache_dir))) != "valid"]
+    results = {}
+    if not sources:
+        return results
+    max_workers = min(max_workers or os.cpu_count() or 1, len(sources))
+    # spawn instead of fork: the caller may be a multi-threaded server (Streamlit)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        futures = {pool.submit(_prepare, source, cache_dir): source for source in sources}
+        for future in as_completed(futures):
+            source = futures[future]
+            try:
+                results[source] = future.result()
+            except Exception as e:
+                results[source] = e
+    return results
+
+
+if __name__ == "__main__":
+    import sys
+
+    # python -m evaluator.warmup data/*-eval.jsonl
+    for source, result in warm_up(sys.argv[1:]).items():
+        print(f"{source} -> {result}")
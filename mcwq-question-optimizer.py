@@ -1,13 +1,50 @@
+import asyncio
 import json
-import time
-from pathlib import Path
-from openai import OpenAI
+from openai import AsyncOpenAI
 from decouple import config
 
+from optimizer.batch import BatchRunner
+from optimizer.cache import ResponseCache
+from optimizer.dedup import DedupPlan, benchmark_entities, cluster_request, parse_cluster_response
+from optimizer.engine import RateLimiter, RequestEngine
+from optimizer.resume import ResultWriter, ResumeIndex
+
 
 # Configure OpenAI API - new client initialization
+# OPENAI_BASE_URL can point to any OpenAI-compatible server, e.g. python -m optimizer.stub_server
 openai_api_key = config('OPENAI_API_KEY')
-client = OpenAI(api_key=openai_api_key)
+openai_base_url = config('OPENAI_BASE_URL', default=None)
+# retries are handled by the request engine, which also respects the rate limits
+client = AsyncOpenAI(api_key=openai_api_key,
+                     base_url=openai_base_url, max_retries=0)
+
+model = config('OPTIMIZER_MODEL', default='gpt-4')
+# 'async' sends requests right away, 'batch' uses the (cheaper, slower) Batch API
+mode = config('OPTIMIZER_MODE', default='async')
+# number of requests in flight at the same time
+concurrency = config('OPTIMIZER_CONCURRENCY', default=8, cast=int)
+# rate limits of the provider, 0 disables the limit
+requests_per_minute = config('OPTIMIZER_REQUESTS_PER_MINUTE', default=0, cast=int)
+tokens_per_minute = config('OPTIMIZER_TOKENS_PER_MINUTE', default=0, cast=int)
+max_retries = config('OPTIMIZER_MAX_RETRIES', default=6, cast=int)
+# write results in the order of the questions, otherwise as soon as they arrive
+ordered_output = config('OPTIMIZER_ORDERED_OUTPUT', default=True, cast=bool)
+# responses are cached by (model, prompt, question, params), an empty path disables the cache
+cache_path = config('OPTIMIZER_CACHE_PATH',
+                    default='.cache/optimizer-responses.sqlite')
+cache_ttl_days = config('OPTIMIZER_CACHE_TTL_DAYS', default=0, cast=float)
+cache_max_entries = config('OPTIMIZER_CACHE_MAX_ENTRIES', default=0, cast=int)
+# results are fsynced to outfile every this many questions (and at least every 10 seconds)
+checkpoint_every = config('OPTIMIZER_CHECKPOINT_EVERY', default=50, cast=int)
+# batch mode: requests per batch job, where job files and their state are kept, and how often to poll
+batch_size = config('OPTIMIZER_BATCH_SIZE', default=1000, cast=int)
+batch_dir = config('OPTIMIZER_BATCH_DIR', default='.cache/batches')
+batch_poll_seconds = config('OPTIMIZER_BATCH_POLL_SECONDS', default=60, cast=float)
+# near-duplicate questions (MinHash/LSH with masked entities): 'off', 'representative' sends one question per
+# group of entity swaps and transfers its optimization to the others, 'cluster' sends each cluster as one request
+dedup = config('OPTIMIZER_DEDUP', default='off')
+dedup_threshold = config('OPTIMIZER_DEDUP_THRESHOLD', default=0.5, cast=float)
+dedup_cluster_size = config('OPTIMIZER_DEDUP_CLUSTER_SIZE', default=10, cast=int)
 
 outfile = 'data/mcwq-optimized-questions.jsonl'
 
@@ -24,20 +61,12 @@ questions = list(set(questions))
 print(json.dumps(questions[:10], indent=4))
 
 
-# if outfile does not exist, create it
-if not Path(outfile).exists():
-    with open(outfile, 'w', encoding='utf-8') as file:
-        pass
-
-# read the JSON file outfile and remove the questions that are already in the list
-questions_already_optimized = []
-with open(outfile, 'r', encoding='utf-8') as file:
-    for line in file:
-        data = json.loads(line)
-        questions_already_optimized.append(data['question_original'])
+# skip the questions that are already in outfile (a line cut off by a crash is removed first)
+already_optimized = ResumeIndex(outfile, key_field='question_original')
 
 questions = [
-    question for question in questions if question not in questions_already_optimized]
+    question for question in questions if question not in already_optimized]
+print(f"{len(already_optimized)} questions already optimized, {len(questions)} remaining")
 
 # limit the number of questions to 10
 # questions = questions[:10]
@@ -59,24 +88,141 @@ You will need to:
 Question: 
 """
 
+cluster_prompt = """
+You are a helpful assistant that optimizes questions that need to be answered by a knowledge graph.
+You will be given a numbered list of similar questions and you will need to optimize each of them, s.t., the question is easier to understand.
+However, it is important that the semantics of each question are not changed.
 
-for i, question in enumerate(questions, 1):
-    print(f"\nProcessing question {i}/{len(questions)}")
-    response = client.chat.completions.create(
-        model="gpt-4",
-        messages=[{"role": "user", "content": prompt + question}]
-    )
+You will need to:
+- make the question more specific
+- make the question more concise
+- make the question more clear
 
-    # pretty print the response
-    print(f"{i}. Original question:\n{question}")
-    print(f"{i}. Optimized question:\n{response.choices[0].message.content}")
-    print("-"*30)
+Answer with the optimized questions only, one per line, numbered as in the list.
+
+Questions:
+"""
 
-    # store the question and the response in a new file
-    with open(outfile, 'a', encoding='utf-8') as file:
-        # get the response content
-        optimized_question = response.choices[0].message.content
-        file.write(json.dumps({'question_original': question, 'llm_generated_optimized_question': optimized_question,
-                   'final_optimized_question': optimized_question, 'validation_status': "no"}) + '\n')
 
-print(f"Finished processing {len(questions)} questions, written to {outfile}")
+def make_engine(prompt, cache=None):
+    return RequestEngine(client, model, prompt, concurrency=concurrency,
+                         rate_limiter=RateLimiter(
+                             requests_per_minute, tokens_per_minute),
+                         max_retries=max_retries, cache=cache)
+
+
+def write_result(writer, question, optimized_question, **extra):
+    writer.write({'question_original': question, 'llm_generated_optimized_question': optimized_question,
+                  'final_optimized_question': optimized_question, 'validation_status': "no", **extra})
+
+
+async def optimize_questions(questions, writer, cache=None):
+    engine = make_engine(prompt, cache)
+    processed = 0
+    i = 0
+    async for question, optimized_question in engine.run(questions, ordered=ordered_output):
+        i += 1
+        print(f"\nProcessed question {i}/{len(questions)}")
+        if optimized_question is None:
+            print(f"{i}. Failed question (will be retried in the next run):\n{question}")
+            continue
+
+        # pretty print the response
+        print(f"{i}. Original question:\n{question}")
+        print(f"{i}. Optimized question:\n{optimized_question}")
+        print("-"*30)
+
+        # store the question and the response in a new file
+        write_result(writer, question, optimized_question)
+        processed += 1
+    return processed
+
+
+async def optimize_clusters(batches, writer, cache=None):
+    """Sends every batch of near-duplicate questions as one request, returns the questions left unanswered"""
+    engine = make_engine(cluster_prompt, cache)
+    requests = {cluster_request(batch): batch for batch in batches}
+    processed = 0
+    left = []
+    async for request, content in engine.run(list(requests), ordered=ordered_output):
+        batch = requests[request]
+        for question, optimized_question in zip(batch, parse_cluster_response(content, len(batch))):
+            if optimized_question is None:
+                left.append(question)
+                continue
+            write_result(writer, question, optimized_question, cluster_size=len(batch))
+            processed += 1
+    print(f"{processed} questions optimized in {len(requests)} cluster requests, {len(left)} left")
+    return processed, left
+
+
+class TransferWriter:
+    """Writes the optimization of a representative also for its entity swaps, collects the ones that failed"""
+
+    def __init__(self, writer, plan):
+        self.writer = writer
+        self.plan = plan
+        self.index = writer.index
+        self.left = []
+        self.transferred = 0
+
+    def write(self, record):
+        self.writer.write(record)
+        representative = record['question_original']
+        for question, optimized_question in self.plan.transfers(representative, record['final_optimized_question']):
+            if optimized_question is None:
+                self.left.append(question)
+            else:
+                write_result(self.writer, question, optimized_question, transferred_from=representative)
+                self.transferred += 1
+
+    def checkpoint(self):
+        self.writer.checkpoint()
+
+
+async def optimize(questions, writer, cache=None):
+    if mode == 'batch':
+        runner = BatchRunner(client, model, prompt, batch_dir, chunk_size=batch_size,
+                             poll_interval=batch_poll_seconds, cache=cache)
+        return await runner.run(questions, writer)
+    return await optimize_questions(questions, writer, cache)
+
+
+async def optimize_deduplicated(questions, writer, cache=None):
+    plan = DedupPlan(questions, benchmark_entities(), threshold=dedup_threshold)
+    print(f"{len(questions)} questions in {len(plan.clusters)} clusters, "
+          f"{len(plan.representatives())} after merging entity swaps")
+    processed = 0
+    if dedup == 'cluster' and mode != 'batch':
+        batches = plan.batches(dedup_cluster_size)
+        processed, left = await optimize_clusters(batches, writer, cache)
+        clustered = {question for batch in batches for question in batch}
+        questions = [question for question in questions if question not in clustered] + left
+        plan = DedupPlan(questions, benchmark_entities(), threshold=dedup_threshold)
+    elif dedup == 'cluster':
+        print("Cluster requests are not supported in batch mode, sending representatives instead")
+    # representatives (and the remaining questions), their optimizations are transferred to the entity swaps
+    transfer_writer = TransferWriter(writer, plan)
+    processed += await optimize(plan.representatives(), transfer_writer, cache) + transfer_writer.transferred
+    if transfer_writer.left:
+        print(f"{len(transfer_writer.left)} entity swaps could not be transferred, sending them")
+        processed += await optimize(transfer_writer.left, writer, cache)
+    return processed
+
+
+cache = None
+if cache_path:
+    cache = ResponseCache(cache_path, ttl=cache_ttl_days * 24 * 3600,
+                          max_entries=cache_max_entries)
+
+with ResultWriter(outfile, index=already_optimized, checkpoint_every=checkpoint_every) as writer:
+    if dedup != 'off':
+        processed = asyncio.run(optimize_deduplicated(questions, writer, cache))
+    else:
+        processed = asyncio.run(optimize(questions, writer, cache))
+
+if cache is not None:
+    print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+    cache.close()
+
+print(f"Finished processing {processed}/{len(questions)} questions, written to {outfile}")
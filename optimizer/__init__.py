@@ -0,0 +1 @@
+"""Helpers for mcwq-question-optimizer.py"""
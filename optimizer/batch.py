@@ -0,0 +1,178 @@
+"""Optimizing questions through the OpenAI Batch API"""
+import asyncio
+import json
+from pathlib import Path
+
+from optimizer.cache import ResponseCache
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# final batch states, anything else is still running
+BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchRunner:
+    """Writes batch job files in chunks, submits and polls them, and merges the results into the output file
+
+    The state of every chunk is kept in work_dir/state.json, so an interrupted run continues where it stopped:
+    submitted batches are polled again instead of being resubmitted, and questions of failed batches are put
+    into new chunks.
+    """
+
+    def __init__(self, client, model, prompt, work_dir, chunk_size=1000, poll_interval=60, params=None, cache=None):
+        self.client = client
+        self.model = model
+        self.prompt = prompt
+        self.work_dir = Path(work_dir)
+        self.chunk_size = max(1, chunk_size)
+        self.poll_interval = poll_interval
+        self.params = params or {}
+        self.cache = cache
+        self.state_file = self.work_dir / "state.json"
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if self.state_file.exists():
+            with open(self.state_file, "r", encoding="utf-8") as file:
+                return json.load(file)
+        return {"chunks": []}
+
+    def _save_state(self):
+        tmp_file = self.state_file.with_suffix(".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as file:
+            json.dump(self.state, file, indent=2)
+        tmp_file.replace(self.state_file)
+
+    def custom_id(self, question):
+        return ResponseCache.key(self.model, self.prompt, question, self.params)
+
+    def _request_line(self, question):
+        return {
+            "custom_id": self.custom_id(question),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {"model": self.model, "messages": [{"role": "user", "content": self.prompt + question}], **self.params},
+        }
+
+    def _chunk_questions(self, chunk):
+        """Maps custom_id to question for the requests of a chunk"""
+        if "questions" in chunk:
+            return chunk["questions"]
+        # chunks of an older state: the question is the request text without the prompt, which only holds if
+        # the prompt did not change since, i.e. the custom_id can be computed again from it
+        questions = {}
+        with open(self.work_dir / chunk["file"], "r", encoding="utf-8") as file:
+            for line in file:
+                request = json.loads(line)
+                content = request["body"]["messages"][-1]["content"]
+                question = content[len(self.prompt):]
+                if content.startswith(self.prompt) and self.custom_id(question) == request["custom_id"]:
+                    questions[request["custom_id"]] = question
+        if not questions:
+            print(f"{chunk['file']} was created with another prompt or model, its results are not merged")
+        return questions
+
+    def _active_questions(self):
+        """Questions that are part of a chunk that is not finished yet"""
+        active = set()
+        for chunk in self.state["chunks"]:
+            if chunk["status"] in ("created", "submitted"):
+                active.update(self._chunk_questions(chunk).values())
+        return active
+
+    def create_chunks(self, questions):
+        """Writes job files for the questions that are not already part of an unfinished chunk"""
+        active = self._active_questions()
+        questions = [question for question in questions if question not in active]
+        for start in range(0, len(questions), self.chunk_size):
+            name = f"chunk-{len(self.state['chunks']):04d}.jsonl"
+            chunk_questions = {}
+            with open(self.work_dir / name, "w", encoding="utf-8") as file:
+                for question in questions[start:start + self.chunk_size]:
+                    request = self._request_line(question)
+                    chunk_questions[request["custom_id"]] = question
+                    file.write(json.dumps(request) + "\n")
+            # results are mapped back to their question by custom_id, independent of the current prompt
+            self.state["chunks"].append({"file": name, "status": "created", "input_file_id": None, "batch_id": None,
+                                         "questions": chunk_questions})
+            print(f"Created {name} with {len(questions[start:start + self.chunk_size])} requests")
+        self._save_state()
+
+    async def submit(self, chunk):
+        path = self.work_dir / chunk["file"]
+        if chunk["input_file_id"] is None:
+            uploaded = await self.client.files.create(file=(path.name, path.read_bytes()), purpose="batch")
+            chunk["input_file_id"] = uploaded.id
+            self._save_state()
+        batch = await self.client.batches.create(input_file_id=chunk["input_file_id"], endpoint=BATCH_ENDPOINT,
+                                                 completion_window="24h")
+        chunk["batch_id"] = batch.id
+        chunk["status"] = "submitted"
+        self._save_state()
+        print(f"Submitted {chunk['file']} as batch {batch.id}")
+
+    async def merge(self, chunk, batch, writer):
+        """Writes the successful results of a finished batch, returns their number"""
+        if not batch.output_file_id:
+            return 0
+        questions = self._chunk_questions(chunk)
+        output = await self.client.files.content(batch.output_file_id)
+        merged = 0
+        for line in output.text.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            question = questions.get(result.get("custom_id"))
+            response = result.get("response") or {}
+            if question is None or response.get("status_code") != 200:
+                continue
+            optimized_question = response["body"]["choices"][0]["message"]["content"]
+            if self.cache is not None:
+                self.cache.put(result["custom_id"], optimized_question, model=self.model, question=question)
+            if writer.index is not None and question in writer.index:
+                continue
+            writer.write({'question_original': question, 'llm_generated_optimized_question': optimized_question,
+                          'final_optimized_question': optimized_question, 'validation_status': "no"})
+            merged += 1
+        writer.checkpoint()
+        return merged
+
+    async def run(self, questions, writer):
+        """Optimizes the questions, returns the number of results written"""
+        written = 0
+        if self.cache is not None:
+            remaining = []
+            for question in questions:
+                cached = self.cache.get(self.custom_id(question))
+                if cached is None:
+                    remaining.append(question)
+                    continue
+                if writer.index is not None and question in writer.index:
+                    continue
+                writer.write({'question_original': question, 'llm_generated_optimized_question': cached,
+                              'final_optimized_question': cached, 'validation_status': "no"})
+                written += 1
+            questions = remaining
+
+        self.create_chunks(questions)
+        for chunk in self.state["chunks"]:
+            if chunk["status"] == "created":
+                await self.submit(chunk)
+
+        while True:
+            running = [chunk for chunk in self.state["chunks"] if chunk["status"] == "submitted"]
+            if not running:
+                break
+            for chunk in running:
+                batch = await self.client.batches.retrieve(chunk["batch_id"])
+                if batch.status not in BATCH_DONE:
+                    continue
+                merged = await self.merge(chunk, batch, writer)
+                written += merged
+                # questions of a failed or expired batch without results are chunked again in the next run
+                chunk["status"] = "merged" if batch.status == "completed" else "failed"
+                self._save_state()
+                print(f"Batch {batch.id} ({chunk['file']}) {batch.status}, merged {merged} results")
+            if any(chunk["status"] == "submitted" for chunk in self.state["chunks"]):
+                await asyncio.sleep(self.poll_interval)
+        return written
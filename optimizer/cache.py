@@ -0,0 +1,94 @@
+"""Persistent content-addressed cache of LLM responses"""
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+
+
+class ResponseCache:
+    """SQLite cache of responses keyed by a hash of model, prompt template, question and sampling params
+
+    ttl (seconds) and max_entries limit the cache, 0 disables the limit. Least recently used entries are
+    evicted first: when the cache is opened and closed, and every evict_every inserts, so a long or crashed
+    run exceeds max_entries by less than evict_every entries.
+    """
+
+    def __init__(self, path, ttl=0, max_entries=0, evict_every=100):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._puts = 0
+        self.hits = 0
+        self.misses = 0
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                question TEXT,
+                content TEXT NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.evict()
+
+    @staticmethod
+    def key(model, prompt, question, params=None):
+        """Hash of everything that influences the response"""
+        payload = json.dumps({"model": model, "prompt": prompt, "question": question, "params": params or {}},
+                             sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """Returns the cached content or None"""
+        row = self._connection.execute(
+            "SELECT content, created FROM responses WHERE key = ?", (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl and now - row[1] > self.ttl):
+            self.misses += 1
+            return None
+        self._connection.execute(
+            "UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        self._connection.commit()
+        self.hits += 1
+        return row[0]
+
+    def put(self, key, content, model=None, question=None):
+        now = time.time()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO responses (key, model, question, content, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, model, question, content, now, now))
+        self._puts += 1
+        if self._puts % self.evict_every == 0:
+            # in the same transaction as the insert
+            self._delete_evicted()
+        self._connection.commit()
+
+    def evict(self):
+        """Removes expired entries and the least recently used ones above max_entries"""
+        self._delete_evicted()
+        self._connection.commit()
+
+    def _delete_evicted(self):
+        if self.ttl:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+        if self.max_entries:
+            self._connection.execute("""
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )""", (self.max_entries,))
+
+    def __len__(self):
+        return self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self):
+        self.evict()
+        self._connection.close()
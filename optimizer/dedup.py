@@ -0,0 +1,222 @@
+"""Near-duplicate detection of questions, so that template-derived questions can share requests
+
+Questions are reduced to word shingles with their entities masked (MCWQ questions differ mostly in the
+entities of their template), hashed into MinHash signatures, and candidate pairs are found by LSH banding.
+Candidates whose estimated Jaccard similarity reaches the threshold are merged into clusters. Everything runs
+locally on the CPU.
+
+python -m optimizer.dedup data/mcwq-qwen_2.5-eval.jsonl --threshold 0.5   # print the clusters
+"""
+import hashlib
+import json
+import re
+
+import numpy as np
+
+BENCHMARK = "benchmarks/mcwq.json"
+# token that replaces every entity
+ENTITY = "<e>"
+MERSENNE = (1 << 61) - 1
+BRACKETS = re.compile(r"\[([^\]]+)\]")
+WORD = re.compile(r"\w+|\x00")
+
+
+def benchmark_entities(path=BENCHMARK):
+    """{question: [entities in order of appearance]} from questionWithBrackets of the benchmark"""
+    with open(path, "r", encoding="utf-8") as file:
+        entries = json.load(file)
+    return {BRACKETS.sub(r"\1", entry["questionWithBrackets"]): BRACKETS.findall(entry["questionWithBrackets"])
+            for entry in entries if entry.get("questionWithBrackets")}
+
+
+def guess_entities(question):
+    """Runs of capitalized words after the first word, for questions without known entities"""
+    words = question.split()
+    entities = []
+    current = []
+    for word in words[1:] + [""]:
+        if word[:1].isupper() or word[:1].isdigit():
+            current.append(word)
+        elif current:
+            entities.append(" ".join(current))
+            current = []
+    return entities
+
+
+def mask_entities(question, entities=None):
+    """Lower case tokens of a question with every entity replaced by ENTITY, and the entities"""
+    if entities is None:
+        entities = guess_entities(question)
+    masked = question
+    # longest first, an entity may contain another one
+    for entity in sorted(entities, key=len, reverse=True):
+        masked = masked.replace(entity, " \x00 ")
+    tokens = [ENTITY if token == "\x00" else token for token in WORD.findall(masked.lower())]
+    return tokens, entities
+
+
+def shingles(tokens, size=2):
+    """Word n-grams of the tokens, the tokens themselves if there are fewer than size"""
+    if len(tokens) < size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def _hash(shingle):
+    # stable across runs, unlike hash()
+    return int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "little")
+
+
+class MinHasher:
+    """MinHash signatures with num_perm universal hash functions (a * x + b) mod 2^61 - 1"""
+
+    def __init__(self, num_perm=128, seed=1):
+        random = np.random.default_rng(seed)
+        # a * x stays below 2^63 for 32 bit shingle hashes
+        self.a = random.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self.b = random.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+        self.num_perm = num_perm
+
+    def signature(self, shingle_set):
+        hashes = np.fromiter((_hash(shingle) for shingle in shingle_set), dtype=np.uint64)
+        if not len(hashes):
+            return np.full(self.num_perm, MERSENNE, dtype=np.uint64)
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % MERSENNE).min(axis=1)
+
+    def signatures(self, shingle_sets):
+        return np.stack([self.signature(shingle_set) for shingle_set in shingle_sets]) if shingle_sets \
+            else np.zeros((0, self.num_perm), dtype=np.uint64)
+
+
+def lsh_bands(num_perm, threshold):
+    """Number of bands whose LSH threshold (1 / bands) ^ (1 / rows) is closest to the similarity threshold"""
+    divisors = [bands for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(divisors, key=lambda bands: abs((1 / bands) ** (bands / num_perm) - threshold))
+
+
+def _find(parents, i):
+    while parents[i] != i:
+        parents[i] = parents[parents[i]]
+        i = parents[i]
+    return i
+
+
+def cluster_signatures(signatures, threshold=0.5, bands=None):
+    """Clusters (lists of row indices, in order) of signatures whose estimated Jaccard similarity >= threshold
+
+    Rows that share a bucket in any LSH band are compared with the first row of the bucket.
+    """
+    count, num_perm = signatures.shape
+    bands = bands or lsh_bands(num_perm, threshold)
+    rows = num_perm // bands
+    parents = list(range(count))
+    for band in range(bands):
+        keys = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        _, buckets = np.unique(keys.view(np.dtype((np.void, keys.dtype.itemsize * rows))).ravel(),
+                               return_inverse=True)
+        order = np.argsort(buckets, kind="stable")
+        starts = np.flatnonzero(np.r_[True, buckets[order][1:] != buckets[order][:-1]])
+        for members in np.split(order, starts[1:]):
+            if len(members) < 2:
+                continue
+            leader = members[0]
+            similarity = (signatures[members[1:]] == signatures[leader]).mean(axis=1)
+            for member in members[1:][similarity >= threshold]:
+                parents[_find(parents, member)] = _find(parents, leader)
+    clusters = {}
+    for i in range(count):
+        clusters.setdefault(_find(parents, i), []).append(i)
+    return sorted(clusters.values())
+
+
+def transfer(optimized, entities, target_entities):
+    """The optimized question of one question rewritten for another with the same template but other entities
+
+    Returns None unless every entity of the source appears in the optimized question.
+    """
+    if len(entities) != len(target_entities) or not all(entity in optimized for entity in entities):
+        return None
+    # placeholders first, so that an entity is never replaced twice
+    for i, entity in enumerate(sorted(entities, key=len, reverse=True)):
+        optimized = optimized.replace(entity, f"\x00{i}\x00")
+    for i, entity in enumerate(sorted(entities, key=len, reverse=True)):
+        optimized = optimized.replace(f"\x00{i}\x00", target_entities[entities.index(entity)])
+    return optimized
+
+
+class DedupPlan:
+    """Clusters of near-duplicate questions and the groups of pure entity swaps within them
+
+    clusters: lists of questions (MinHash/LSH over the masked shingles), the first one is the representative.
+    templates: {representative: [questions]} of questions whose masked tokens are identical to the
+    representative's, an optimization of the representative can be transferred to them.
+    """
+
+    def __init__(self, questions, entities=None, threshold=0.5, num_perm=128, seed=1):
+        entities = entities or {}
+        masked = [mask_entities(question, entities.get(question)) for question in questions]
+        self.entities = {question: question_entities for question, (_, question_entities) in zip(questions, masked)}
+        hasher = MinHasher(num_perm, seed)
+        signatures = hasher.signatures([shingles(tokens) for tokens, _ in masked])
+        self.clusters = [[questions[i] for i in cluster] for cluster in cluster_signatures(signatures, threshold)]
+
+        self.templates = {}
+        for cluster in self.clusters:
+            representatives = {}
+            for question in cluster:
+                key = tuple(mask_entities(question, self.entities[question])[0])
+                representative = representatives.setdefault(key, question)
+                self.templates.setdefault(representative, [])
+                if representative != question:
+                    self.templates[representative].append(question)
+
+    def batches(self, max_size=10):
+        """The clusters split into requests of at most max_size questions, single questions are left out"""
+        return [cluster[i:i + max_size] for cluster in self.clusters if len(cluster) > 1
+                for i in range(0, len(cluster), max_size)]
+
+    def representatives(self):
+        """One question per group of entity swaps"""
+        return list(self.templates)
+
+    def transfers(self, representative, optimized):
+        """(question, optimized question) of the entity swaps of a representative, None where it can't be transferred"""
+        entities = self.entities[representative]
+        return [(question, transfer(optimized, entities, self.entities[question]))
+                for question in self.templates.get(representative, [])]
+
+
+def cluster_request(questions):
+    """One request for a cluster: the questions numbered, one per line"""
+    return "\n".join(f"{i}. {question}" for i, question in enumerate(questions, 1))
+
+
+def parse_cluster_response(content, count):
+    """The numbered answers of a cluster request, None for every number missing from the response"""
+    answers = [None] * count
+    for match in re.finditer(r"^\s*(\d+)[.)]\s*(.+?)\s*$", content or "", re.MULTILINE):
+        number = int(match.group(1))
+        if 1 <= number <= count and answers[number - 1] is None:
+            answers[number - 1] = match.group(2)
+    return answers
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Clusters of near-duplicate questions of evaluation files")
+    parser.add_argument("sources", nargs="+", help="JSONL files with a question field")
+    parser.add_argument("--threshold", type=float, default=0.5)
+    args = parser.parse_args()
+
+    questions = []
+    for source in args.sources:
+        with open(source, "r", encoding="utf-8") as file:
+            questions += [json.loads(line)["question"] for line in file if line.strip()]
+    questions = list(dict.fromkeys(questions))
+    plan = DedupPlan(questions, benchmark_entities(), args.threshold)
+    for cluster in plan.clusters:
+        if len(cluster) > 1:
+            print(json.dumps(cluster, ensure_ascii=False))
+    print(f"{len(questions)} questions, {len(plan.clusters)} clusters, "
+          f"{len(plan.representatives())} after merging entity swaps")
@@ -0,0 +1,190 @@
+"""Concurrent, rate-limited execution of chat completion requests"""
+import asyncio
+import random
+import time
+
+from openai import APIConnectionError, APIStatusError
+
+# status codes worth retrying: rate limits, timeouts and server side errors
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token), good enough for rate limiting"""
+    return max(1, len(text) // 4)
+
+
+class RateLimiter:
+    """Token buckets for requests per minute and tokens per minute (0 disables a limit)"""
+
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._requests = min(self.requests_per_minute,
+                                 self._requests + elapsed * self.requests_per_minute / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute,
+                               self._tokens + elapsed * self.tokens_per_minute / 60)
+
+    @staticmethod
+    def _wait_time(available, needed, per_minute):
+        if not per_minute or available >= needed:
+            return 0
+        return (needed - available) * 60 / per_minute
+
+    async def acquire(self, tokens=1):
+        """Waits until one request with the given number of tokens may be sent"""
+        if self.tokens_per_minute:
+            # a single request larger than the bucket would otherwise wait forever
+            tokens = min(tokens, self.tokens_per_minute)
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = max(self._wait_time(self._requests, 1, self.requests_per_minute),
+                           self._wait_time(self._tokens, tokens, self.tokens_per_minute))
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests_per_minute:
+                self._requests -= 1
+            if self.tokens_per_minute:
+                self._tokens -= tokens
+
+    def adjust(self, estimated_tokens, actual_tokens):
+        """Corrects the token bucket once the real usage of a request is known"""
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute,
+                               self._tokens + estimated_tokens - actual_tokens)
+
+
+class RequestEngine:
+    """Sends one chat completion per question with bounded concurrency, rate limiting and retries"""
+
+    def __init__(self, client, model, prompt, concurrency=8, rate_limiter=None, max_retries=6,
+                 backoff_base=1.0, backoff_max=60.0, expected_completion_tokens=200, params=None,
+                 cache=None):
+        self.client = client
+        self.model = model
+        self.prompt = prompt
+        self.concurrency = max(1, concurrency)
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.expected_completion_tokens = expected_completion_tokens
+        self.params = params or {}
+        # optional ResponseCache, consulted before any request is sent
+        self.cache = cache
+        # set when the server asks us to slow down, so that all workers back off together
+        self._paused_until = 0
+
+    def _backoff(self, attempt, error):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt)
+        delay *= 0.5 + random.random() / 2
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, float(retry_after))
+            except ValueError:
+                pass
+        return delay
+
+    async def _wait_if_paused(self):
+        delay = self._paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def complete(self, question):
+        """Returns the response content for a single question, retrying 429/5xx and connection errors"""
+        cache_key = None
+        if self.cache is not None:
+            cache_key = self.cache.key(self.model, self.prompt, question, self.params)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        content = self.prompt + question
+        estimated_tokens = estimate_tokens(content) + self.expected_completion_tokens
+
+        for attempt in range(self.max_retries + 1):
+            await self._wait_if_paused()
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire(estimated_tokens)
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[{"role": "user", "content": content}],
+                    **self.params
+                )
+            except (APIStatusError, APIConnectionError) as e:
+                status_code = getattr(e, "status_code", None)
+                if attempt == self.max_retries or (status_code is not None and status_code not in RETRYABLE_STATUS_CODES):
+                    raise
+                delay = self._backoff(attempt, e)
+                if status_code == 429:
+                    self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                print(f"Retrying in {delay:.1f}s after error ({status_code}): {e}")
+                await asyncio.sleep(delay)
+                continue
+
+            if self.rate_limiter is not None and response.usage is not None:
+                self.rate_limiter.adjust(estimated_tokens, response.usage.total_tokens)
+            result = response.choices[0].message.content
+            if self.cache is not None and result is not None:
+                self.cache.put(cache_key, result, model=self.model, question=question)
+            return result
+
+    async def run(self, questions, ordered=True):
+        """Yields (question, content) pairs, in input order if ordered is set, else as they finish
+
+        content is None if the request for a question failed after all retries.
+        """
+        queue = asyncio.Queue()
+        for item in enumerate(questions):
+            queue.put_nowait(item)
+        total = queue.qsize()
+        results = asyncio.Queue()
+
+        async def worker():
+            while True:
+                try:
+                    index, question = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    content = await self.complete(question)
+                except Exception as e:
+                    print(f"Failed to process question {question!r}: {e}")
+                    content = None
+                await results.put((index, question, content))
+
+        workers = [asyncio.create_task(worker())
+                   for _ in range(min(self.concurrency, total))]
+        pending = {}
+        next_index = 0
+        try:
+            for _ in range(total):
+                index, question, content = await results.get()
+                if not ordered:
+                    yield question, content
+                    continue
+                # hold back results until all earlier questions are done
+                pending[index] = (question, content)
+                while next_index in pending:
+                    yield pending.pop(next_index)
+                    next_index += 1
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
@@ -0,0 +1,110 @@
+"""Resuming interrupted optimizer runs"""
+import json
+import os
+import time
+from pathlib import Path
+
+
+def repair_jsonl(path):
+    """Removes a partially written last line (e.g. after a crash), returns the number of bytes dropped"""
+    path = Path(path)
+    if not path.exists():
+        return 0
+    with open(path, "rb+") as file:
+        size = file.seek(0, os.SEEK_END)
+        if size == 0:
+            return 0
+        # the last line is at most a few KB, only read the end of the file
+        tail_start = max(0, size - 65536)
+        file.seek(tail_start)
+        tail = file.read()
+        if tail.endswith(b"\n"):
+            return 0
+        last_newline = tail.rfind(b"\n")
+        if last_newline == -1 and tail_start > 0:
+            # very long last line, fall back to reading the whole file
+            file.seek(0)
+            tail = file.read()
+            tail_start = 0
+            last_newline = tail.rfind(b"\n")
+        last_line = tail[last_newline + 1:]
+        try:
+            json.loads(last_line)
+        except ValueError:
+            file.truncate(tail_start + last_newline + 1)
+            return len(last_line)
+        # complete record that only misses its line break
+        file.write(b"\n")
+        return 0
+
+
+class ResumeIndex:
+    """Hash set of the keys already present in a JSONL output file"""
+
+    def __init__(self, path, key_field="question_original"):
+        self.path = path
+        self.key_field = key_field
+        self._keys = set()
+        dropped = repair_jsonl(path)
+        if dropped:
+            print(f"Removed truncated last line ({dropped} bytes) from {path}")
+        if Path(path).exists():
+            self._load()
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as file:
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    self._keys.add(json.loads(line)[self.key_field])
+                except (ValueError, KeyError) as e:
+                    print(f"Skipping broken line {number} in {self.path}: {e}")
+
+    def __contains__(self, key):
+        return key in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, key):
+        self._keys.add(key)
+
+
+class ResultWriter:
+    """Single buffered append handle for a JSONL file, fsynced every few records/seconds"""
+
+    def __init__(self, path, index=None, checkpoint_every=50, checkpoint_seconds=10.0):
+        self.path = path
+        self.index = index
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self._file = open(path, "a", encoding="utf-8")
+        self._pending = 0
+        self._last_checkpoint = time.monotonic()
+
+    def write(self, record):
+        self._file.write(json.dumps(record) + "\n")
+        if self.index is not None:
+            self.index.add(record[self.index.key_field])
+        self._pending += 1
+        if self._pending >= self.checkpoint_every or time.monotonic() - self._last_checkpoint >= self.checkpoint_seconds:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Makes everything written so far durable"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_checkpoint = time.monotonic()
+
+    def close(self):
+        if not self._file.closed:
+            self.checkpoint()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,206 @@
+"""Minimal OpenAI-compatible server to exercise the optimizer without calling the real API
+
+Start it and point the optimizer at it:
+
+    python -m optimizer.stub_server --port 8000 --failure-rate 0.1 --latency 0.2
+    OPENAI_BASE_URL=http://localhost:8000/v1 OPENAI_API_KEY=stub python mcwq-question-optimizer.py
+
+Besides chat completions it implements the file upload and batch endpoints used by the batch mode. Batches
+are executed right away and report "completed" on the second poll.
+
+The "optimized" question is the original question with a prefix, so results are easy to check.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OPTIMIZED_PREFIX = "Optimized: "
+
+
+def fake_completion(body):
+    """Builds a chat completion response for a chat completion request body"""
+    content = body["messages"][-1]["content"]
+    if "Questions:" in content:
+        # cluster prompt: numbered questions after "Questions:", answered with the same numbers
+        question = content.rsplit("Questions:", 1)[-1].strip()
+        answer = re.sub(r"^(\d+)\.\s*", rf"\1. {OPTIMIZED_PREFIX}", question, flags=re.MULTILINE)
+    else:
+        # the optimizer prompt ends with "Question: " followed by the question
+        question = content.rsplit("Question:", 1)[-1].strip()
+        answer = OPTIMIZED_PREFIX + question
+    prompt_tokens = max(1, len(content) // 4)
+    completion_tokens = max(1, len(question) // 4)
+    return {
+        "id": f"chatcmpl-stub-{random.getrandbits(32):08x}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": answer},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def parse_multipart(content_type, body):
+    """Returns the fields of a multipart/form-data body as {name: (filename, bytes)}"""
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        fields[name] = (part.get_filename(), part.get_payload(decode=True))
+    return fields
+
+
+def _new_id(prefix):
+    return f"{prefix}-stub-{random.getrandbits(32):08x}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    failure_rate = 0.0
+    # uploaded files {id: (file object, content)} and batches {id: (batch object, output file id)}
+    files = {}
+    batches = {}
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length)
+
+    def _maybe_fail(self):
+        """Randomly answers with a rate limit or server error, returns True if it did"""
+        if random.random() >= self.failure_rate:
+            return False
+        if random.random() < 0.5:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                            headers={"Retry-After": "0.1"})
+        else:
+            self._send_json(500, {"error": {"message": "Internal server error", "type": "server_error"}})
+        return True
+
+    def _store_file(self, filename, content, purpose):
+        file_object = {"id": _new_id("file"), "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                       "filename": filename, "purpose": purpose, "status": "processed"}
+        with self.lock:
+            self.files[file_object["id"]] = (file_object, content)
+        return file_object
+
+    def _run_batch(self, input_file_id):
+        """Answers every request of a batch input file, returns (output file object, number of requests)"""
+        with self.lock:
+            _, content = self.files[input_file_id]
+        lines = []
+        for line in content.decode("utf-8").splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            lines.append(json.dumps({
+                "id": _new_id("batch_req"),
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": _new_id("req"), "body": fake_completion(request["body"])},
+                "error": None,
+            }))
+        return self._store_file("batch_output.jsonl", ("\n".join(lines) + "\n").encode("utf-8"), "batch_output"), len(lines)
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.latency:
+            time.sleep(self.latency)
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            if self._maybe_fail():
+                return
+            self._send_json(200, fake_completion(json.loads(body)))
+        elif path.endswith("/files"):
+            fields = parse_multipart(self.headers["Content-Type"], body)
+            filename, content = fields["file"]
+            purpose = fields.get("purpose", (None, b"batch"))[1].decode("utf-8")
+            self._send_json(200, self._store_file(filename, content, purpose))
+        elif path.endswith("/batches"):
+            request = json.loads(body)
+            output_file, count = self._run_batch(request["input_file_id"])
+            batch = {"id": _new_id("batch"), "object": "batch", "endpoint": request["endpoint"],
+                     "input_file_id": request["input_file_id"], "completion_window": request["completion_window"],
+                     "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                     "error_file_id": None, "request_counts": {"total": count, "completed": 0, "failed": 0}}
+            with self.lock:
+                self.batches[batch["id"]] = (batch, output_file["id"])
+            self._send_json(200, batch)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content" and parts[-2] in self.files:
+            _, content = self.files[parts[-2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        elif len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in self.batches:
+            with self.lock:
+                batch, output_file_id = self.batches[parts[-1]]
+                # the first poll still reports the batch as running
+                if batch["status"] == "in_progress" and batch.get("_polled"):
+                    batch.update(status="completed", output_file_id=output_file_id, completed_at=int(time.time()))
+                    batch["request_counts"]["completed"] = batch["request_counts"]["total"]
+                batch["_polled"] = True
+            self._send_json(200, {k: v for k, v in batch.items() if not k.startswith("_")})
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+def start_stub_server(port=0, latency=0.0, failure_rate=0.0):
+    """Starts the stub server in a background thread, returns (server, base_url)"""
+    handler = type("ConfiguredStubHandler", (StubHandler,),
+                   {"latency": latency, "failure_rate": failure_rate, "files": {}, "batches": {}})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="seconds to wait before answering each request")
+    parser.add_argument("--failure-rate", type=float, default=0.0,
+                        help="fraction of requests answered with 429 or 500")
+    args = parser.parse_args()
+
+    server, base_url = start_stub_server(args.port, args.latency, args.failure_rate)
+    print(f"Stub OpenAI server listening on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
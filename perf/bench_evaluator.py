@@ -0,0 +1,215 @@
+"""Benchmarks of the evaluator hot paths
+
+Runs the stages of the UI (compiling and loading files, preprocess, statistics, the question index, the
+summary table, the charts) on the files in data/ and on synthetic copies scaled up 10× and 100×, and
+reports wall time, peak traced memory and allocated blocks per stage. Results can be saved as a baseline
+and compared with an earlier one; the exit code is 1 if a stage got slower than --max-slowdown.
+
+python -m perf.bench_evaluator                       # all stages, data/mcwq-qwen_2.5 at 1×, 10×, 100×
+python -m perf.bench_evaluator --scales 1 10 --save  # write perf/baselines/<date>-<revision>.json
+python -m perf.bench_evaluator --compare             # compare with the latest baseline
+"""
+import argparse
+import gc
+import importlib.util
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+from evaluator.charts import outcome_pies
+from evaluator.columnar import OUTCOMES, load_eval_file
+from evaluator.dataset import DATA_DIR, EvalFile
+from evaluator.index import QuestionIndex
+from evaluator.preprocess import preprocess
+from evaluator.sparql import analyze
+from evaluator.statistics import Statistics, prepare_stats
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_DIR = ROOT / "perf" / "baselines"
+SYNTHETIC_DIR = ROOT / ".cache" / "perf"
+DEFAULT_SOURCE = "mcwq-qwen_2.5-eval.jsonl"
+
+
+def load_ui():
+    """The Streamlit script as a module, importing it has no side effects"""
+    spec = importlib.util.spec_from_file_location("data_evaluator_ui", ROOT / "data-evaluator-ui.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def scaled_file(source, scale):
+    """Synthetic copy of an evaluation file with every question repeated scale times (as new questions)"""
+    if scale == 1:
+        return Path(source)
+    target = SYNTHETIC_DIR / f"{Path(source).name[:-len('-eval.jsonl')]}-x{scale}-eval.jsonl"
+    if target.exists() and target.stat().st_mtime >= Path(source).stat().st_mtime:
+        return target
+    SYNTHETIC_DIR.mkdir(parents=True, exist_ok=True)
+    with open(source, "r", encoding="utf-8") as file:
+        records = [json.loads(line) for line in file if line.strip()]
+    with open(target.with_suffix(".tmp"), "w", encoding="utf-8") as file:
+        for copy in range(scale):
+            for record in records:
+                file.write(json.dumps({**record, "question": f"{record['question']} [{copy}]"},
+                                      ensure_ascii=False) + "\n")
+    target.with_suffix(".tmp").replace(target)
+    return target
+
+
+def measure(run, setup=None, repeat=5):
+    """Median and best wall time (over repeat runs), then peak traced memory and allocated blocks of one run"""
+    times = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        gc.collect()
+        start = time.perf_counter()
+        run(argument)
+        times.append(time.perf_counter() - start)
+    argument = setup() if setup else None
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    tracemalloc.start()
+    result = run(argument)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    blocks = sys.getallocatedblocks() - blocks
+    del result
+    return {"median_ms": statistics.median(times) * 1000, "min_ms": min(times) * 1000,
+            "peak_kib": peak / 1024, "blocks": blocks}
+
+
+def stages(source, ui, work_dir):
+    """(name, setup, run) of every benchmarked stage of one file"""
+    cache_dir = work_dir / "cache"
+    columns = load_eval_file(source, cache_dir)
+    with open(source, "r", encoding="utf-8") as file:
+        lines = [line for line in file if line.strip()]
+    statistics_ = Statistics(columns)
+    index = QuestionIndex(columns)
+    models = statistics_.models
+    counts = tuple(tuple(tuple(statistics_.outcome_counts(model, process)[icon] for icon in OUTCOMES[:3])
+                         for process in ui.PROCESSES) for model in models)
+
+    # compiling and preprocessing parse the queries, which are cached by analyze across repeats
+    def cold_cache():
+        shutil.rmtree(work_dir / "cold", ignore_errors=True)
+        analyze.cache_clear()
+        return work_dir / "cold"
+
+    def fresh_records():
+        analyze.cache_clear()
+        return [json.loads(line) for line in lines]
+
+    def rerun(_):
+        # what a UI rerun does for a file that is not loaded yet
+        eval_file = EvalFile(source, cache_dir)
+        page = eval_file.index.page(0, 50)
+        return eval_file.statistics, ui.summary_table(eval_file.columns, eval_file.index, page,
+                                                      eval_file.statistics.models)
+
+    def charts(_):
+        outcome_pies.cache_clear()
+        return outcome_pies(counts, tuple(models), tuple(ui.PROCESSES))
+
+    return [
+        ("compile", cold_cache, lambda cache: load_eval_file(source, cache)),
+        ("load", None, lambda _: load_eval_file(source, cache_dir)),
+        ("preprocess", fresh_records, lambda records: [preprocess(record) for record in records]),
+        ("statistics", None, lambda _: Statistics(columns)),
+        ("prepare_stats", None, lambda _: prepare_stats(columns)),
+        ("index", None, lambda _: QuestionIndex(columns)),
+        ("summary_table", None, lambda _: ui.summary_table(columns, index, index.page(0, 50), models)),
+        ("charts", None, charts),
+        ("rerun", None, rerun),
+    ]
+
+
+def run_benchmarks(sources, scales, repeat, only=None):
+    ui = load_ui()
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for source in sources:
+            for scale in scales:
+                path = scaled_file(source, scale)
+                dataset = f"{Path(source).name} ×{scale}"
+                rows = len(load_eval_file(path, Path(work_dir) / "cache"))
+                for name, setup, run in stages(path, ui, Path(work_dir)):
+                    if only and name not in only:
+                        continue
+                    # the big files are measured fewer times
+                    result = measure(run, setup, repeat if scale < 100 else max(1, repeat // 5))
+                    result.update(stage=name, dataset=dataset, rows=rows)
+                    results.append(result)
+                    print(f"{dataset:40} {name:14} {rows:>8} rows {result['median_ms']:>10.1f} ms "
+                          f"{result['peak_kib']:>10.0f} KiB {result['blocks']:>8} blocks", flush=True)
+    return results
+
+
+def revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save_baseline(results):
+    BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    path = BASELINE_DIR / f"{now:%Y%m%d-%H%M%S}-{revision()}.json"
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"created": now.isoformat(), "revision": revision(), "python": sys.version.split()[0],
+                   "results": results}, file, ensure_ascii=False, indent=1)
+    return path
+
+
+def compare(results, baseline_path, max_slowdown):
+    """Prints the time ratio of every stage against the baseline, returns the stages slower than max_slowdown"""
+    with open(baseline_path, "r", encoding="utf-8") as file:
+        baseline = {(result["dataset"], result["stage"]): result for result in json.load(file)["results"]}
+    slower = []
+    for result in results:
+        before = baseline.get((result["dataset"], result["stage"]))
+        if before is None or not before["median_ms"]:
+            continue
+        ratio = result["median_ms"] / before["median_ms"]
+        flag = " SLOWER" if ratio > max_slowdown else ""
+        print(f"{result['dataset']:40} {result['stage']:14} {before['median_ms']:>10.1f} ms -> "
+              f"{result['median_ms']:>10.1f} ms ({ratio:.2f}×){flag}")
+        if flag:
+            slower.append(result)
+    return slower
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of the evaluator hot paths")
+    parser.add_argument("sources", nargs="*", help=f"evaluation files, default: {DATA_DIR}/{DEFAULT_SOURCE}")
+    parser.add_argument("--scales", nargs="+", type=int, default=[1, 10, 100])
+    parser.add_argument("--stages", nargs="+", help="only run these stages")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", action="store_true", help=f"save the results as a baseline in {BASELINE_DIR}")
+    parser.add_argument("--compare", nargs="?", const="latest", help="baseline to compare with (default: latest)")
+    parser.add_argument("--max-slowdown", type=float, default=1.25)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sources or [str(Path(DATA_DIR) / DEFAULT_SOURCE)], args.scales, args.repeat,
+                             args.stages)
+    if args.compare:
+        baseline = args.compare
+        if baseline == "latest":
+            baselines = sorted(BASELINE_DIR.glob("*.json"))
+            baseline = baselines[-1] if baselines else None
+        if baseline is None:
+            print("no baseline to compare with")
+        elif compare(results, baseline, args.max_slowdown):
+            sys.exit(1)
+    if args.save:
+        print(f"saved {save_baseline(results)}")